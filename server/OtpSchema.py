@@ -1,21 +1,53 @@
-import bcrypt
 from datetime import datetime, timedelta
+import hashlib
+import hmac
+import os
+import secrets
 import uuid
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A 6-digit code that lives a minute is protected by the attempt limit, not by
+# a slow hash, so it is stored as HMAC-SHA256 under a server secret: a leaked
+# record can't be brute-forced offline without the secret, and a check costs
+# microseconds instead of a bcrypt round. Without OTP_HMAC_SECRET a key is
+# derived from the Flask secret, so existing deployments keep working.
+_secret = os.getenv("OTP_HMAC_SECRET")
+OTP_HMAC_KEY = (
+    _secret.encode() if _secret
+    else hmac.new((os.getenv("FLASK_SECRET_KEY") or "").encode(), b"otp-hmac-key", hashlib.sha256).digest()
+)
+
+MAX_OTP_ATTEMPTS = 3
+
+
+def generate_otp():
+    return str(100000 + secrets.randbelow(900000))
+
+
+# Bound to the email, so equal codes of two users don't share a digest
+def otp_digest(email, otp):
+    return hmac.new(OTP_HMAC_KEY, f"{email}\n{otp}".encode(), hashlib.sha256).hexdigest()
+
+
+def otp_matches(stored_digest, email, otp):
+    if not isinstance(stored_digest, str) or not isinstance(otp, (str, int)):
+        return False
+    return hmac.compare_digest(stored_digest, otp_digest(email, str(otp)))
+
+
 class OtpSchema:
     def __init__(self, user_id, email, plain_otp, expiry_minutes=1, attempts=0):
         self.otp_id = str(uuid.uuid4())  # Unique ID for each OTP
         self.user_id = user_id  # User ID (can be None at first)
         self.email = email  # User email
-        self.hashed_otp = self.hash_otp(plain_otp)  # Store hashed OTP
-        self.expiry = datetime.utcnow() + timedelta(minutes=expiry_minutes)  # OTP expiry time
+        self.hashed_otp = otp_digest(email, plain_otp)  # Store the keyed hash only
         self.created_at = datetime.utcnow()  # When OTP was created
+        self.expiry = self.created_at + timedelta(minutes=expiry_minutes)  # TTL index removes the record after this
         self.attempts = attempts  # Track how many failed attempts the user has made
 
-    def hash_otp(self, otp):
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(otp.encode('utf-8'), salt).decode('utf-8')
-
     def to_dict(self):
         return {
             "otp_id": self.otp_id,
@@ -24,6 +56,7 @@ class OtpSchema:
             "otp": self.hashed_otp,
             "expiry": self.expiry,
             "created_at": self.created_at,
-            "attempts": self.attempts  # Add attempts to the dictionary
+            "attempts": self.attempts,
+            # A new code always needs verifying again
+            "verified": False
         }
-
@@ -1,40 +1,99 @@
 # app.py
-from schema import MASTER_KEY, aes_encrypt, aes_decrypt, hash_username
-from flask import Flask, request, jsonify,make_response, redirect
+from schema import MASTER_KEY, aes_decrypt, hash_username, sealer
+from flask import Flask, Request, Response, abort, request, jsonify,make_response, redirect, g, render_template_string
 from flask_cors import CORS
-import tensorflow as tf
 import numpy as np
-import base64
 import io
+import json
 import re
-import smtplib
-from decryption import load_model
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from PIL import Image
-from pymongo import MongoClient
+from mailer import MailQueue, transport_from_env
+from model_registry import ModelUnavailable, model_registry
+from model_backends import CLASS_NAMES
+from batcher import MicroBatcher, BatcherFull
+import inference_server
+from inference_server import InferenceUnavailable
+from prediction_cache import PredictionCache, cache_key
+from token_store import create_token_store
+from email_templates import MagicLinkEmailTemplate, OtpEmailTemplate
+from warmup import Warmup
+import metrics
+from metrics import RequestProfiler, span
+from hmac import compare_digest
+import database
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import jwt
-import bcrypt
+from hashing import bcrypt_service, HashingOverloaded
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
-from schema import UserSchema  # Import UserSchema
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-import random
-from OtpSchema import OtpSchema
+from schema import UserSchema, PredictionSchema, read_prediction, read_prediction_image  # Import UserSchema
+from bson import ObjectId
+from bson.errors import InvalidId
+import rate_limits
+from rate_limits import create_limiter
+from concurrent.futures import ThreadPoolExecutor
+from OtpSchema import MAX_OTP_ATTEMPTS, OtpSchema, generate_otp, otp_matches
+from preprocessing import IMAGE_ERRORS, IMAGE_SIZE, preprocess_image, preprocess_many
 import time
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-import smtplib
-from email.mime.text import MIMEText
+from limits import parse
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, supports_credentials=True, origins=['http://localhost:5173'])
-limiter = Limiter(get_remote_address, app=app)
+# RATELIMIT_ENABLED=0 turns all limits off, for local load tests (benchmarks/e2e.py)
+app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "1") == "1"
+# Counters in RATELIMIT_STORAGE_URI, keyed per user when signed in (see rate_limits.py)
+limiter = create_limiter(app)
 
 MAX_FILE_SIZE = 1 * 1024 * 1024  
+# /predict and /predict/batch share one daily budget counted in images that go
+# through the model (cache hits and rejected files are free)
+PREDICT_LIMIT = parse("5 per day")
+# A bigger batch could never fit in the budget
+PREDICT_BATCH_MAX_IMAGES = int(os.getenv("PREDICT_BATCH_MAX_IMAGES", PREDICT_LIMIT.amount))
+MAX_LOGIN_ATTEMPTS = 3
+LOCKOUT_MINUTES = 15
+# How long a verified email stays good for /signup
+OTP_SIGNUP_WINDOW_MINUTES = int(os.getenv("OTP_SIGNUP_WINDOW_MINUTES", 15))
+
+# Request bodies are capped while they stream in: Werkzeug turns down a
+# Content-Length over the limit before reading anything and stops reading a
+# chunked body as soon as it crosses it (413). Room is left for the multipart
+# headers around each file.
+MULTIPART_OVERHEAD = 16 * 1024
+app.config["MAX_CONTENT_LENGTH"] = MAX_FILE_SIZE + MULTIPART_OVERHEAD
+BODY_LIMITS = {"predict_batch": PREDICT_BATCH_MAX_IMAGES * (MAX_FILE_SIZE + MULTIPART_OVERHEAD)}
+
+
+# Keeps at most `limit` bytes of one uploaded file in memory. The form parser
+# goes on reading the rest (bounded by the body limit) but it is dropped, so
+# the route still sees an oversized file and can report it on its own.
+class CappedUpload(io.BytesIO):
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data):
+        room = self.limit - self.tell()
+        if room > 0:
+            super().write(memoryview(data)[:room])
+        return len(data)
+
+
+class UploadRequest(Request):
+    # Per route body limit, read by Werkzeug before it parses the form
+    @property
+    def max_content_length(self):
+        return BODY_LIMITS.get(self.endpoint, super().max_content_length)
+
+    # Files are kept in memory one byte past MAX_FILE_SIZE instead of spooling to disk
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return CappedUpload(MAX_FILE_SIZE + 1)
+
+
+app.request_class = UploadRequest
 
 
 @app.errorhandler(429)
@@ -44,146 +103,151 @@ def ratelimit_handler(e):
         "message": "Rate limit exceeded. Please try again later."
     }), 429
 
+@app.errorhandler(413)
+def request_too_large_handler(e):
+    return jsonify({
+        "success": False,
+        "message": f"Upload is too large. Maximum allowed size is {MAX_FILE_SIZE // (1024 * 1024)}MB per image."
+    }), 413
+
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded_handler(e):
+    return jsonify({
+        "success": False,
+        "message": "Server is busy, please try again shortly."
+    }), 503
+
 # Load environment variables
 load_dotenv()
 app.secret_key = os.getenv('FLASK_SECRET_KEY')  # Secret key
 serializer = URLSafeTimedSerializer(app.secret_key)
 Base_url = os.getenv('BASE_URL')  # Base URL for image storage
-# MongoDB Atlas Connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["ImageClassification"]
-collection = db["User"]
-otp_collection = db["otps"]
-
-
-# Check MongoDB connection
-try:
-    client.server_info()
-    print("MongoDB connected successfully!")
-except Exception as e:
-    print("MongoDB connection failed. Error:", e)
-
-# Load model
-# model = tf.keras.models.load_model(os.getenv("MODEL_PATH"))
-
-# Function to save the uploaded file
-def save_image(file):
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
+
+# INFERENCE_MODE=shared: one inference process per machine (started by the
+# gunicorn master, see gunicorn.conf.py) instead of a model in every worker.
+# Connected before anything else here starts threads, it may need to fork.
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+if INFERENCE_MODE == "shared":
+    shared_inference = inference_server.connect()
+
+# Fork the bcrypt workers before any model or batcher threads start
+bcrypt_service.start()
+
+# Outgoing emails are queued in Mongo and sent by a background thread over one reused SMTP connection
+mail_queue = MailQueue(database.mail_queue, transport_from_env(), sealer=sealer)
+mail_queue.start()
+
+# The OTP email is built once, each send only fills in the recipient and code
+otp_email = OtpEmailTemplate(os.getenv("SMTP_EMAIL"), expiry_minutes=1)
+
+# One-time login links: a signed, timestamped token from the serializer,
+# made single-use by the token store (in Mongo by default, so any worker can
+# redeem it, see token_store.py)
+MAGIC_LINK_TTL_MINUTES = int(os.getenv("MAGIC_LINK_TTL_MINUTES", 15))
+MAGIC_LINK_URL = os.getenv("MAGIC_LINK_URL", "http://localhost:5000/magic-login")
+MAGIC_LINK_SALT = "magic-link"
+magic_links = create_token_store(database.magic_links, MAGIC_LINK_TTL_MINUTES * 60)
+magic_link_email = MagicLinkEmailTemplate(os.getenv("SMTP_EMAIL"), expiry_minutes=MAGIC_LINK_TTL_MINUTES)
+
+if INFERENCE_MODE == "shared":
+    # Same predict()/stats() as the micro-batcher, batching happens in the inference process
+    inference_batcher = shared_inference
+    model_version = shared_inference.model_version
+else:
+    # Requests are grouped into one forward pass instead of running batch size one
+    inference_batcher = MicroBatcher(
+        lambda batch: _forward(batch),
+        max_batch_size=int(os.getenv("PREDICT_MAX_BATCH_SIZE", 16)),
+        max_wait_ms=float(os.getenv("PREDICT_MAX_WAIT_MS", 10)),
+        max_queue=int(os.getenv("PREDICT_QUEUE_DEPTH", 256)),
+    )
+    model_version = model_registry.current_version
+
+# One forward pass in the batcher thread (its own stage, apart from the queue wait in "inference")
+def _forward(batch):
+    model = model_registry.get()
+    with span("model_forward"):
+        return model.predict(batch, verbose=0)
+
+PREDICT_TIMEOUT = float(os.getenv("PREDICT_TIMEOUT_SECONDS", 30))
+
+
+# Check MongoDB connection and create the indexes the queries rely on
+def warm_database():
+    database.ping()
+    database.ensure_indexes()
+
+
+# Load the model (or wait for the inference process) and run one forward pass
+# through the batcher, so the first real request doesn't pay for either
+def warm_model():
+    inference_batcher.predict(np.zeros((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8), timeout=PREDICT_TIMEOUT)
+
+
+# Both run in the background, the app serves /healthz straight away and
+# /readyz once they have passed
+warmup = Warmup(max_retry_delay=float(os.getenv("WARMUP_MAX_RETRY_SECONDS", 30)))
+warmup.add("database", warm_database)
+warmup.add("model", warm_model)
+warmup.start()
+
+# Repeat uploads of the same image are answered without running the model
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", 1024)),
+    collection=database.prediction_cache if os.getenv("PREDICTION_CACHE_SHARED", "0") == "1" else None,
+)
+
+# Batch uploads are decoded and resized in parallel
+preprocess_pool = ThreadPoolExecutor(max_workers=int(os.getenv("PREPROCESS_WORKERS", 4)), thread_name_prefix="preprocess")
+
+# Uploads are written to disk in the background, off the request path
+image_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-writer")
+
+def _write_image(file_path, image_bytes):
+    try:
+        with open(file_path, "wb") as f:
+            f.write(image_bytes)
+    except OSError as e:
+        print(f"Error saving image {file_path}: {e}")
+
+# Function to save the uploaded bytes, returns the path they will be written to
+def save_image(filename, image_bytes):
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+    image_writer.submit(_write_image, file_path, image_bytes)
     return file_path
-# Function to preprocess the image
-def preprocess_image(file_path):
-    img = Image.open(file_path).convert('RGB')  # Open the image and convert to RGB
-    img = img.resize((256, 256))  # Resize the image
-    img_array = np.array(img)  # Convert image to numpy array
-    # Do NOT divide by 255 because model was trained without normalization
-    img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
-    return img_array
-
-
-# Class names
-class_names = [
-    'american_football', 'baseball', 'basketball', 'billiard_ball',
-    'bowling_ball', 'cricket_ball', 'football', 'golf_ball',
-    'hockey_ball', 'hockey_puck', 'rugby_ball', 'shuttlecock',
-    'table_tennis_ball', 'tennis_ball','volleyball'
-]
+
+
+# Class names, in the order of the model's outputs
+class_names = CLASS_NAMES
 # Configure upload and static folder
 app.config['UPLOAD_FOLDER'] = 'static/images'
 app.config['ALLOWED_EXTENSIONS'] = {'jpg', 'jpeg', 'png'}
 
-one_time_tokens = {}  # token -> {"email": ..., "used": False}
-
-
 # Function to check allowed file types
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
+# ASCII only: the OTP and login emails are prebuilt 7-bit messages with the
+# address pasted into the To header, which SMTPUTF8 addresses can't go through
 def is_valid_email(email):
-    return re.match(r"[^@]+@[^@]+\.[^@]+", email)
+    return isinstance(email, str) and email.isascii() and re.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+", email)
 
 
 def send_email_otp(receiver_email, otp):
-    sender_email = os.getenv("SMTP_EMAIL")
-    sender_password = os.getenv("SMTP_PASSWORD")
-    
-    # Create a secure connection to SMTP server
     try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = receiver_email
-        msg['Subject'] = 'Your One-Time Password (OTP) for Secure Access'
-
-        # Define the expiration time (in minutes)
-        expiration_time = 1
-
-        # HTML email body with professional design
-        html_content = f"""
-        <html>
-        <head>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    color: #333;
-                    background-color: #f4f4f4;
-                    padding: 20px;
-                }}
-                .email-container {{
-                    background-color: #ffffff;
-                    padding: 20px;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                }}
-                .otp-header {{
-                    font-size: 20px;
-                    font-weight: bold;
-                    color: #4CAF50;
-                }}
-                .otp {{
-                    font-size: 32px;
-                    font-weight: bold;
-                    color: #FF5722;
-                    margin: 20px 0;
-                }}
-                .footer {{
-                    font-size: 12px;
-                    color: #888888;
-                    text-align: center;
-                    margin-top: 20px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="email-container">
-                <p>Dear User,</p>
-                <p class="otp-header">Your One-Time Password (OTP)</p>
-                <p class="otp">{otp}</p>
-                <p>This OTP will expire in <strong>{expiration_time} minutes</strong>. Please use it immediately.</p>
-                <p>If you did not request this OTP, please ignore this message.</p>
-                <p class="footer">
-                    For security reasons, we recommend not sharing your OTP with anyone.<br>
-                    <strong>Do not share this OTP with anyone.</strong><br>
-                    If you have any concerns, please contact our support team.
-                </p>
-            </div>
-        </body>
-        </html>
-        """
-
-        # Attach the HTML body to the email
-        msg.attach(MIMEText(html_content, 'html'))
-
-        # Send the email via SMTP with secure SSL connection
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
+        # Queue the email, the background sender delivers it (dropped once the OTP has expired)
+        mail_queue.enqueue(
+            otp_email.sender,
+            receiver_email,
+            otp_email.render(receiver_email, otp),
+            datetime.utcnow() + timedelta(minutes=otp_email.expiry_minutes)
+        )
 
         return True
 
     except Exception as e:
-        print(f"Error sending OTP email: {e}")
+        print(f"Error queueing OTP email: {e}")
         return False
 
 @app.route('/send-otp', methods=['POST'])
@@ -195,17 +259,13 @@ def send_otp():
         return jsonify({"error": "Valid email is required"}), 400
 
     # Generate OTP
-    otp = str(random.randint(100000, 999999))
+    otp = generate_otp()
 
-    # Create OTP object with attempts initialized to 0
+    # Create OTP object with attempts initialized to 0 (only its HMAC is stored)
     otp_obj = OtpSchema(email=email, plain_otp=otp, attempts=0, user_id=None)
 
     # Insert OTP into the database (update or insert)
-    otp_collection.update_one(
-        {"email": email},
-        {"$set": otp_obj.to_dict()},
-        upsert=True
-    )
+    database.upsert_otp(email, otp_obj.to_dict())
 
     # Send OTP email
     if not send_email_otp(email, otp):
@@ -213,54 +273,77 @@ def send_otp():
 
     return jsonify({"message": "OTP sent to your email!"}), 200
 
-def is_otp_valid(record, input_otp):
-    stored_hashed_otp = record.get("otp")
-    expiry_time = record.get("expiry")
-    if datetime.utcnow() > expiry_time:
-        return False
-    return bcrypt.checkpw(input_otp.encode('utf-8'), stored_hashed_otp.encode('utf-8'))
-
 @app.route('/verify-otp', methods=['POST'])
 def verify_otp():
     data = request.json
     email = data.get('username')  # Get email from the request
     otp_input = data.get('otp')  # Get OTP entered by the user
 
-    # Find the OTP record for the given email
-    record = otp_collection.find_one({"email": email})
+    # Use up one attempt on a live OTP record, in the same update that checks it exists
+    now = datetime.utcnow()
+    record = database.use_otp_attempt(email, now, MAX_OTP_ATTEMPTS)
     if not record:
-        return jsonify({"error": "OTP not found"}), 404
-
-    # Check if OTP has expired
-    if datetime.utcnow() > record.get('expiry'):
-        return jsonify({"error": "OTP has expired"}), 400
-
-    # Check if the user has exceeded the maximum number of attempts (3)
-    if record.get('attempts') >= 3:
+        # Find out why for the error message
+        record = database.find_otp_for_verify(email)
+        if not record:
+            return jsonify({"error": "OTP not found"}), 404
+        if now > record.get('expiry'):
+            return jsonify({"error": "OTP has expired"}), 400
         return jsonify({"error": "You have exceeded the maximum OTP attempts. Please try again later."}), 400
 
-    # Validate OTP (compare the entered OTP with the hashed OTP stored in the DB)
-    if not is_otp_valid(record, otp_input):
-        # Increment the attempts counter in the database
-        otp_collection.update_one(
-            {"email": email},
-            {"$inc": {"attempts": 1}}  # Increment the attempts counter by 1
-        )
+    # Validate OTP (constant-time compare against the stored HMAC)
+    if not otp_matches(record.get("otp"), email, otp_input):
         return jsonify({"error": "Invalid OTP"}), 400
 
-    # If OTP is valid, reset the attempts counter and mark the OTP as verified
-    otp_collection.update_one(
-        {"email": email},
-        {"$set": {"verified": True, "attempts": 0}}  # Reset attempts after successful OTP verification
-    )
+    # If OTP is valid, reset the attempts counter, mark it verified and keep it for the signup window
+    database.mark_otp_verified(email, record["otp"], now + timedelta(minutes=OTP_SIGNUP_WINDOW_MINUTES))
 
     return jsonify({"message": "OTP verified successfully!"}), 200
 
 
-# Health check
-@app.route('/', methods=['GET'])
-def status():
-    return jsonify({"message": "Server is up and running!f"}), 200
+# Per-request profiling, off unless PROFILE_TOKEN is set. A request sent with
+# "X-Profile: <token>" runs under the profiler and is answered with the
+# report instead of its normal response (its status is in X-Profiled-Status).
+# Streamed responses are only profiled up to the first chunk.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+
+@app.before_request
+def start_request_metrics():
+    metrics.set_route(request.endpoint)
+    g.request_started = time.perf_counter()
+    header = request.headers.get("X-Profile")
+    if PROFILE_TOKEN and header and compare_digest(header.encode(), PROFILE_TOKEN.encode()):
+        g.profiler = RequestProfiler()
+        g.profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=request.endpoint or "unmatched",
+                                        method=request.method, status=response.status_code)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        report = profiler.stop()
+        return Response(report, mimetype="text/plain", headers={"X-Profiled-Status": str(response.status_code),
+                                                                "X-Profiler": profiler.kind})
+    return response
+
+# Prometheus scrape target: request and per-stage latency histograms of this worker
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Liveness: the process is up and serving requests, nothing else is checked
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"}), 200
+
+# Readiness: database reachable and model loaded, 503 until warmup has finished
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    ready = warmup.ready()
+    return jsonify({"ready": ready, "checks": warmup.status()}), 200 if ready else 503
 
 @app.route('/signup', methods=['POST'])
 @limiter.limit("20 per day")
@@ -273,19 +356,18 @@ def signup():
         return jsonify({"message": "Username and password are required"}), 400
 
     # OTP check
-    otp_record = otp_collection.find_one({"email": username})
+    otp_record = database.find_otp_for_signup(username)
     if not otp_record or not otp_record.get("verified"):
         return jsonify({"error": "OTP not verified. Please verify your email first."}), 403
 
     # Check user by hashed username
     hashed_username = hash_username(username)
-    existing_user = collection.find_one({"username_hash": hashed_username})
-    if existing_user:
+    if database.user_exists(hashed_username):
         return jsonify({"error": "User already exists"}), 409
 
     print(f"\nCreating user with username: {username}, password: {password}")
     user = UserSchema(username, password)
-    collection.insert_one(user.to_dict())
+    database.insert_user(user.to_dict())
     print(f"\nUser created: {user.to_dict()}")
 
     return jsonify({
@@ -293,6 +375,12 @@ def signup():
         "user_id": user.user_id
     }), 201
 
+def create_login_token(user_id):
+    return jwt.encode({
+        'user_id': user_id,
+        'exp': datetime.utcnow() + timedelta(minutes=15)
+    }, app.secret_key, algorithm='HS256')
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
@@ -306,7 +394,7 @@ def login():
 
     # Find user by hashed username
     hashed_username = hash_username(username)
-    user_data = collection.find_one({"username_hash": hashed_username})
+    user_data = database.find_user_for_login(hashed_username)
 
     if not user_data:
         return jsonify({"message": "User not found"}), 404
@@ -318,17 +406,9 @@ def login():
     if decrypted_name != username:
         return jsonify({"message": "Invalid username"}), 401
 
-    # Check for account lockout - new code
+    # Check for account lockout
     current_time = datetime.utcnow()
-    
-    # Initialize failed_attempts if it doesn't exist
-    if 'failed_attempts' not in user_data:
-        collection.update_one(
-            {"username_hash": hashed_username},
-            {"$set": {"failed_attempts": 0, "last_failed_attempt": None, "account_locked_until": None}}
-        )
-        user_data['failed_attempts'] = 0
-    
+
     # Check if account is locked
     if user_data.get('account_locked_until'):
         lock_time = user_data['account_locked_until']
@@ -344,60 +424,128 @@ def login():
             }), 403
 
     # Check password
-    if not bcrypt.checkpw(password.encode('utf-8'), user_data['password'].encode('utf-8')):
-        # Update failed attempts count
-        new_attempt_count = user_data.get('failed_attempts', 0) + 1
-        update_data = {
-            "failed_attempts": new_attempt_count,
-            "last_failed_attempt": current_time
-        }
-        
-        # Lock account if failed attempts >= 3
-        if new_attempt_count >= 3:
-            # Lock for 15 minutes
-            lockout_time = current_time + timedelta(minutes=15)
-            update_data["account_locked_until"] = lockout_time
-            
-            collection.update_one(
-                {"username_hash": hashed_username},
-                {"$set": update_data}
-            )
-            
+    if not bcrypt_service.check(password, user_data['password']):
+        # Count the failure and lock on the last allowed attempt in one atomic update
+        lockout_time = current_time + timedelta(minutes=LOCKOUT_MINUTES)
+        new_attempt_count = database.record_failed_login(
+            hashed_username, current_time, MAX_LOGIN_ATTEMPTS, lockout_time
+        )
+
+        # None means a concurrent attempt locked the account a moment ago
+        if new_attempt_count is None or new_attempt_count >= MAX_LOGIN_ATTEMPTS:
             return jsonify({
-                "message": "Account locked due to too many failed attempts. Please try again after 15 minutes.",
+                "message": f"Account locked due to too many failed attempts. Please try again after {LOCKOUT_MINUTES} minutes.",
                 "locked": True,
-                "lockout_remaining": 15
+                "lockout_remaining": LOCKOUT_MINUTES
             }), 403
-        else:
-            collection.update_one(
-                {"username_hash": hashed_username},
-                {"$set": update_data}
-            )
-            
-            remaining_attempts = 3 - new_attempt_count
-            return jsonify({
-                "message": f"Invalid password. {remaining_attempts} attempts remaining before account lockout.",
-                "remaining_attempts": remaining_attempts
-            }), 401
-
-    # If login successful, reset failed attempts counter
-    collection.update_one(
-        {"username_hash": hashed_username},
-        {"$set": {"failed_attempts": 0, "last_failed_attempt": None, "account_locked_until": None}}
-    )
+
+        remaining_attempts = MAX_LOGIN_ATTEMPTS - new_attempt_count
+        return jsonify({
+            "message": f"Invalid password. {remaining_attempts} attempts remaining before account lockout.",
+            "remaining_attempts": remaining_attempts
+        }), 401
+
+    # If login successful, reset failed attempts counter (only when there is something to reset)
+    if user_data.get('failed_attempts') or user_data.get('account_locked_until'):
+        database.reset_login_failures(hashed_username)
 
     # Generate JWT token
-    token = jwt.encode({
-        'user_id': user_data['user_id'],
-        'exp': datetime.utcnow() + timedelta(minutes=15)
-    }, app.secret_key, algorithm='HS256')
+    token = create_login_token(user_data['user_id'])
 
     response = jsonify({"message": "Login successful", "username": decrypted_name})
     response.set_cookie('token', token, httponly=True, secure=True, samesite='Strict', max_age=3600)
     return response, 200
 
+@app.route('/generate-magic-link', methods=['POST'])
+@limiter.limit("5 per hour")
+def generate_magic_link():
+    data = request.json or {}
+    email = data.get('email')
+
+    if not email or not is_valid_email(email):
+        return jsonify({"error": "Valid email is required"}), 400
+
+    # Same answer whether or not there is an account, so this can't be used to find users
+    if database.user_exists(hash_username(email)):
+        token = serializer.dumps(email, salt=MAGIC_LINK_SALT)
+        try:
+            magic_links.issue(token, email)
+            mail_queue.enqueue(
+                magic_link_email.sender,
+                email,
+                magic_link_email.render(email, f"{MAGIC_LINK_URL}?token={token}"),
+                datetime.utcnow() + timedelta(minutes=MAGIC_LINK_TTL_MINUTES)
+            )
+        except Exception as e:
+            print(f"Error issuing magic link: {e}")
+            return jsonify({"error": "Failed to send email"}), 500
+
+    return jsonify({"message": "If an account exists for this email, a login link has been sent."}), 200
+
+# Mail clients and link scanners open every link they find, so following the
+# link only shows this page and the token is spent by the button's POST
+MAGIC_LOGIN_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>Log in</title></head>
+<body>
+<form method="post" action="{{ url_for('redeem_magic_link') }}">
+<input type="hidden" name="token" value="{{ token }}">
+<button type="submit">Log in as {{ email }}</button>
+</form>
+</body>
+</html>"""
+
+# Email in a magic-link token, or the error response to send back.
+# Signature and age first, so forged or stale links never reach the store.
+def _magic_link_email(token):
+    try:
+        return serializer.loads(token, salt=MAGIC_LINK_SALT, max_age=MAGIC_LINK_TTL_MINUTES * 60), None
+    except SignatureExpired:
+        return None, (jsonify({"message": "Login link has expired"}), 400)
+    except BadSignature:
+        return None, (jsonify({"message": "Invalid login link"}), 400)
+
+@app.route('/magic-login', methods=['GET'])
+def magic_login():
+    token = request.args.get('token', '')
+    email, error = _magic_link_email(token)
+    if error:
+        return error
+
+    response = make_response(render_template_string(MAGIC_LOGIN_PAGE, token=token, email=email))
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Referrer-Policy'] = 'no-referrer'
+    return response
+
+@app.route('/magic-login', methods=['POST'])
+def redeem_magic_link():
+    data = request.get_json(silent=True) or request.form
+    token = data.get('token') or ''
+    email, error = _magic_link_email(token)
+    if error:
+        return error
+
+    if magic_links.consume(token) != email:
+        return jsonify({"message": "Login link has already been used or has expired"}), 400
+
+    user_data = database.find_user_for_login(hash_username(email))
+    if not user_data:
+        return jsonify({"message": "User not found"}), 404
+
+    token = create_login_token(user_data['user_id'])
+
+    response = jsonify({"message": "Login successful", "username": email})
+    response.set_cookie('token', token, httponly=True, secure=True, samesite='Strict', max_age=3600)
+    return response, 200
+
+# Takes the prediction budget in one atomic hit, right before inference once
+# the cost is known, so concurrent requests can't all pass a check and then
+# overspend it. A request turned away costs nothing.
+def take_prediction_budget(cost):
+    if not rate_limits.hit(limiter, PREDICT_LIMIT, "predict", cost=cost):
+        abort(429)
+
 @app.route('/predict', methods=['POST'])
-@limiter.limit("5 per day")  # 3 predictions per day per user/IP
 def predict():
     try:
         # Get the token from Cookies instead of headers
@@ -407,7 +555,8 @@ def predict():
             return jsonify({"success": False, "message": "Missing authentication token"}), 401
 
         # Decode the token to get user_id
-        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
+        with span("jwt_decode"):
+            payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
         user_id = payload['user_id']
 
         # Check if image is provided
@@ -416,53 +565,53 @@ def predict():
 
         file = request.files['image']
 
-        # Check file size before processing
-        file.seek(0, os.SEEK_END)
-        file_length = file.tell()
-        file.seek(0)  # Reset file pointer
-        if file_length > MAX_FILE_SIZE:
-            return jsonify({"success": False, "message": "File size is too large. Maximum allowed size is 2MB"}), 400
+        # Read the upload once, one byte past the limit to detect oversized files
+        with span("read_upload"):
+            image_bytes = file.read(MAX_FILE_SIZE + 1)
+        if len(image_bytes) > MAX_FILE_SIZE:
+            return jsonify({"success": False, "message": f"File size is too large. Maximum allowed size is {MAX_FILE_SIZE // (1024 * 1024)}MB"}), 400
 
         if not allowed_file(file.filename):
             return jsonify({"error": "Invalid image type"}), 400
 
-        # Save the image
-        file_path = save_image(file)
-
-        # Preprocess the image
-        img_array = preprocess_image(file_path)
-
-        # Load the decrypted model (example)
-        model = load_model()
-
-        # Predict
-        preds = model.predict(img_array)
-        predicted_class_idx = int(np.argmax(preds, axis=1)[0])
-        predicted_class_name = class_names[predicted_class_idx]
+        # Same image and model as an earlier prediction: reuse its result
+        with span("cache_lookup"):
+            key = cache_key(image_bytes, model_version())
+            predicted_class_name = prediction_cache.get(key)
+
+        if predicted_class_name is None:
+            # Preprocess straight from the in-memory bytes
+            # The header is checked first, a wrong format or oversized image is never decoded
+            try:
+                with span("preprocess"):
+                    img_array = preprocess_image(io.BytesIO(image_bytes))
+            except IMAGE_ERRORS:
+                return jsonify({"error": "Invalid image file"}), 400
+
+            take_prediction_budget(1)
+
+            # Predict, batched together with other concurrent requests
+            with span("inference"):
+                preds = inference_batcher.predict(img_array, timeout=PREDICT_TIMEOUT)
+            predicted_class_idx = int(np.argmax(preds))
+            predicted_class_name = class_names[predicted_class_idx]
+            prediction_cache.put(key, predicted_class_name)
+
+        # Save the same bytes in the background
+        with span("save_image"):
+            file_path = save_image(file.filename, image_bytes)
 
         # Generate URL for image
         image_url = f"{Base_url}/static/images/{os.path.basename(file_path)}"
 
-        # Convert input image to base64
-        input_image_base64 = base64.b64encode(open(file_path, "rb").read()).decode()
-
-        # Create prediction object
-        # Encrypt all fields
-        encrypted_prediction = {
-        "input_image": aes_encrypt(input_image_base64, MASTER_KEY),
-        "result": aes_encrypt(predicted_class_name, MASTER_KEY),
-        "image_url": aes_encrypt(image_url, MASTER_KEY),
-        "predicted_at": aes_encrypt(datetime.utcnow().isoformat(), MASTER_KEY)
-        }
-
+        # Create prediction object (fields and raw image sealed)
+        with span("seal"):
+            document = PredictionSchema(user_id, image_bytes, predicted_class_name, image_url).to_dict()
 
-        # Update user's predictions in MongoDB
-        result = collection.update_one(
-            {"user_id": user_id},
-            {"$push": {"predictions": encrypted_prediction}}
-        )
-
-        if result.modified_count == 0:
+        # Store it in its own collection and keep only a summary on the user
+        with span("db_write"):
+            saved = database.add_prediction(document)
+        if not saved:
             print(f"Warning: No user found with id {user_id} to update prediction.")
 
         return jsonify({
@@ -471,14 +620,280 @@ def predict():
             "image_url": image_url
         })
 
+    except (BatcherFull, InferenceUnavailable, ModelUnavailable):
+        return jsonify({"error": "Server is busy, please try again shortly"}), 503
     except jwt.ExpiredSignatureError:
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
         return jsonify({"error": "Invalid token"}), 401
+    except HTTPException:
+        # e.g. 413 from the body limit, answered by its error handler
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Several images in one request: parallel preprocessing, one trip through the
+# model and one bulk insert. Every image gets its own result or error.
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    try:
+        token = request.cookies.get('token')
+        if not token:
+            return jsonify({"success": False, "message": "Missing authentication token"}), 401
+
+        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
+        user_id = payload['user_id']
+
+        files = request.files.getlist('images')
+        if not files:
+            return jsonify({"error": "No image files provided"}), 400
+        if len(files) > PREDICT_BATCH_MAX_IMAGES:
+            return jsonify({"error": f"Too many images, at most {PREDICT_BATCH_MAX_IMAGES} per request"}), 400
+
+        version = model_version()
+        results = [{"filename": file.filename} for file in files]
+        uploads = {}  # index -> image bytes, for every file that passed the checks
+        pending = []  # indexes that still need the model
+
+        for i, file in enumerate(files):
+            image_bytes = file.read(MAX_FILE_SIZE + 1)
+            if len(image_bytes) > MAX_FILE_SIZE:
+                results[i]["error"] = f"File size is too large. Maximum allowed size is {MAX_FILE_SIZE // (1024 * 1024)}MB"
+            elif not allowed_file(file.filename):
+                results[i]["error"] = "Invalid image type"
+            else:
+                uploads[i] = image_bytes
+                results[i]["cache_key"] = cache_key(image_bytes, version)
+                cached = prediction_cache.get(results[i]["cache_key"])
+                if cached is None:
+                    pending.append(i)
+                else:
+                    results[i]["predicted_class_name"] = cached
+
+        if pending:
+            # Decode straight into one batch tensor, then drop the rows that failed
+            batch = np.empty((len(pending), IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8)
+            with span("preprocess"):
+                errors = preprocess_many([io.BytesIO(uploads[i]) for i in pending], batch, preprocess_pool)
+            decoded = [row for row, error in enumerate(errors) if error is None]
+            for row, error in enumerate(errors):
+                if error is not None:
+                    results[pending[row]]["error"] = "Invalid image file"
+                    del uploads[pending[row]]
+            if len(decoded) < len(pending):
+                batch = batch[decoded]
+            pending = [pending[row] for row in decoded]
+
+        if pending:
+            take_prediction_budget(len(pending))
+            with span("inference"):
+                preds = inference_batcher.predict_many(batch, timeout=PREDICT_TIMEOUT)
+            for i, row in zip(pending, preds):
+                results[i]["predicted_class_name"] = class_names[int(np.argmax(row))]
+                prediction_cache.put(results[i]["cache_key"], results[i]["predicted_class_name"])
+
+        documents = []
+        with span("seal"):
+            for i, image_bytes in uploads.items():
+                file_path = save_image(files[i].filename, image_bytes)
+                results[i]["image_url"] = f"{Base_url}/static/images/{os.path.basename(file_path)}"
+                documents.append(PredictionSchema(
+                    user_id,
+                    image_bytes,
+                    results[i]["predicted_class_name"],
+                    results[i]["image_url"]
+                ).to_dict())
+
+        if documents:
+            with span("db_write"):
+                saved = database.add_predictions(user_id, documents)
+            if not saved:
+                print(f"Warning: No user found with id {user_id} to update prediction.")
+
+        for result in results:
+            result.pop("cache_key", None)
+
+        return jsonify({
+            "user_id": user_id,
+            "results": results,
+            "succeeded": len(documents),
+            "failed": len(results) - len(documents)
+        }), 200 if documents else 400
+
+    except (BatcherFull, InferenceUnavailable, ModelUnavailable):
+        return jsonify({"error": "Server is busy, please try again shortly"}), 503
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+    except HTTPException:
+        # e.g. 413 from the body limit, answered by its error handler
+        raise
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def _encode_cursor(doc):
+    return f"{doc['created_at'].isoformat()}_{doc['_id']}"
+
+def _decode_cursor(cursor):
+    created_at, _, object_id = cursor.rpartition("_")
+    return datetime.fromisoformat(created_at), ObjectId(object_id)
+
+# user_id from the login cookie, or the error response to send back
+def _authenticated_user_id():
+    token = request.cookies.get('token')
+    if not token:
+        return None, (jsonify({"success": False, "message": "Missing authentication token"}), 401)
+    try:
+        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({"error": "Token expired"}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({"error": "Invalid token"}), 401)
+    return payload['user_id'], None
+
+# Fields /predictions can return (besides the id) and the stored fields each one is read from
+PREDICTION_HISTORY_FIELDS = {
+    "result": ("record", "result"),
+    "image_url": ("record", "image_url"),
+    "predicted_at": ("created_at",)
+}
+PREDICTIONS_PAGE_MAX = int(os.getenv("PREDICTIONS_PAGE_MAX", 1000))
+
+# Only the requested fields are decrypted
+def _history_entry(doc, user_id, fields):
+    entry = {"id": str(doc["_id"])}
+    sealed_fields = [field for field in ("result", "image_url") if field in fields]
+    if sealed_fields:
+        entry.update(read_prediction(doc, user_id, sealed_fields) or dict.fromkeys(sealed_fields))
+    if "predicted_at" in fields:
+        entry["predicted_at"] = doc["created_at"].isoformat()
+    return entry
+
+# Encodes one entry at a time straight off the Mongo cursor, so memory stays
+# the same whatever the page size. The cursor is fetched with limit + 1 to
+# tell whether another page follows.
+def _stream_history(docs, user_id, fields, limit, ndjson):
+    sent = 0
+    last = None
+    next_cursor = None
+    try:
+        if not ndjson:
+            yield '{"predictions":['
+        for doc in docs:
+            if sent == limit:
+                next_cursor = _encode_cursor(last)
+                break
+            entry = json.dumps(_history_entry(doc, user_id, fields))
+            if ndjson:
+                yield entry + "\n"
+            else:
+                yield ("," if sent else "") + entry
+            sent += 1
+            last = doc
+    finally:
+        docs.close()
+
+    if ndjson:
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+    else:
+        yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+# Paginated prediction history of the logged in user, newest first, streamed as
+# JSON (default) or NDJSON (?format=ndjson or Accept: application/x-ndjson,
+# one prediction per line and a last line with next_cursor).
+# ?fields=result,predicted_at limits what is read and decrypted; the image
+# itself is only served by /predictions/<id>/image.
+@app.route('/predictions', methods=['GET'])
+def list_predictions():
+    user_id, error = _authenticated_user_id()
+    if error:
+        return error
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), PREDICTIONS_PAGE_MAX)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    fields = set(PREDICTION_HISTORY_FIELDS)
+    if request.args.get('fields'):
+        fields = {field.strip() for field in request.args['fields'].split(',') if field.strip()}
+        unknown = fields - set(PREDICTION_HISTORY_FIELDS)
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+
+    before = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            before = _decode_cursor(cursor)
+        except (ValueError, InvalidId):
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    ndjson = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+
+    # created_at is always read, the page cursor is built from it
+    projection = {"created_at": 1}
+    for field in fields:
+        projection.update(dict.fromkeys(PREDICTION_HISTORY_FIELDS[field], 1))
+    docs = database.iter_predictions(user_id, limit + 1, before, projection)
+
+    return Response(
+        _stream_history(docs, user_id, fields, limit, ndjson),
+        mimetype='application/x-ndjson' if ndjson else 'application/json'
+    )
+
+def _image_mimetype(image_bytes):
+    if image_bytes.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_bytes.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    return "application/octet-stream"
+
+# The uploaded image of one prediction, decrypted only when asked for
+@app.route('/predictions/<prediction_id>/image', methods=['GET'])
+def prediction_image(prediction_id):
+    user_id, error = _authenticated_user_id()
+    if error:
+        return error
+
+    try:
+        doc = database.find_prediction_image(user_id, ObjectId(prediction_id))
+    except InvalidId:
+        doc = None
+    if not doc:
+        return jsonify({"error": "Prediction not found"}), 404
+
+    image_bytes = read_prediction_image(doc, user_id)
+    if image_bytes is None:
+        return jsonify({"error": "Could not decrypt image"}), 500
+
+    response = make_response(image_bytes)
+    response.mimetype = _image_mimetype(image_bytes)
+    # A stored image never changes
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+# bcrypt pool stats (queue wait and hash time) and outgoing mail counters
+@app.route('/auth/stats', methods=['GET'])
+def auth_stats():
+    return jsonify({
+        "bcrypt": bcrypt_service.stats(),
+        "mail": mail_queue.stats(),
+        "magic_links": magic_links.stats()
+    }), 200
+
+# Micro-batching stats (batch timing and fill ratio) and cache hit/miss counters
+@app.route('/predict/stats', methods=['GET'])
+def predict_stats():
+    return jsonify({
+        "batcher": inference_batcher.stats(),
+        "cache": prediction_cache.stats()
+    }), 200
+
 @app.route('/logout', methods=['POST'])
 def logout():
     response = make_response(jsonify({"message": "Logged out"}))
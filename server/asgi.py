@@ -0,0 +1,254 @@
+# Production serving mode on ASGI:
+#
+#   WEB_CONCURRENCY=4 uvicorn asgi:application --host 0.0.0.0 --port 5000
+#
+# uvicorn takes its worker count from WEB_CONCURRENCY, and each worker's
+# bcrypt pool sizes itself to cores // WEB_CONCURRENCY (pass the count this
+# way rather than with --workers, or set BCRYPT_WORKERS).
+#
+# /send-otp, /verify-otp, /signup and /login are native async handlers: Mongo
+# goes through PyMongo's asyncio client and bcrypt is awaited on the hashing
+# process pool, so a request that is waiting never holds a thread. Every other
+# route (/predict and friends) is the Flask app behind a WSGI adapter, where
+# inference already runs on the micro-batcher thread.
+import time
+from datetime import datetime, timedelta
+
+from a2wsgi import WSGIMiddleware
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import async_database
+import metrics
+from app import (
+    LOCKOUT_MINUTES, MAX_LOGIN_ATTEMPTS, OTP_SIGNUP_WINDOW_MINUTES, app as flask_app, create_login_token, is_valid_email, limiter,
+    mail_queue, otp_email,
+)
+from hashing import HashingOverloaded, bcrypt_service
+from OtpSchema import MAX_OTP_ATTEMPTS, OtpSchema, generate_otp, otp_matches
+from schema import MASTER_KEY, UserSchema, aes_decrypt, hash_username
+
+SIGNUP_LIMIT = parse("20/day")
+# Counted in the Flask limiter's storage, shared between workers when
+# RATELIMIT_STORAGE_URI is Mongo or Redis. The limits package's asyncio Mongo
+# backend needs motor, so the (rare) signup hit runs on the thread pool instead.
+# With RATELIMIT_ENABLED=0 the limiter has no storage and signup isn't limited.
+rate_limiter = FixedWindowRateLimiter(limiter.storage) if limiter.enabled else None
+
+
+async def _json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def send_otp(request):
+    data = await _json_body(request)
+    email = data.get('username') if data else None
+
+    if not email or not is_valid_email(email):
+        return JSONResponse({"error": "Valid email is required"}, 400)
+
+    # Generate OTP, only its HMAC is stored (microseconds, fine on the event loop)
+    otp = generate_otp()
+    otp_obj = OtpSchema(email=email, plain_otp=otp, attempts=0, user_id=None)
+
+    await async_database.upsert_otp(email, otp_obj.to_dict())
+
+    # Queue the email for the background sender
+    try:
+        await async_database.enqueue_mail(mail_queue.build_job(
+            otp_email.sender,
+            email,
+            otp_email.render(email, otp),
+            datetime.utcnow() + timedelta(minutes=otp_email.expiry_minutes)
+        ))
+        mail_queue.notify()
+    except Exception as e:
+        print(f"Error queueing OTP email: {e}")
+        return JSONResponse({"error": "Failed to send email"}, 500)
+
+    return JSONResponse({"message": "OTP sent to your email!"}, 200)
+
+
+async def verify_otp(request):
+    data = await _json_body(request) or {}
+    email = data.get('username')
+    otp_input = data.get('otp')
+
+    # Same steps as the Flask route: use up an attempt atomically, then compare
+    now = datetime.utcnow()
+    record = await async_database.use_otp_attempt(email, now, MAX_OTP_ATTEMPTS)
+    if not record:
+        record = await async_database.find_otp_for_verify(email)
+        if not record:
+            return JSONResponse({"error": "OTP not found"}, 404)
+        if now > record.get('expiry'):
+            return JSONResponse({"error": "OTP has expired"}, 400)
+        return JSONResponse({"error": "You have exceeded the maximum OTP attempts. Please try again later."}, 400)
+
+    if not otp_matches(record.get("otp"), email, otp_input):
+        return JSONResponse({"error": "Invalid OTP"}, 400)
+
+    await async_database.mark_otp_verified(email, record["otp"], now + timedelta(minutes=OTP_SIGNUP_WINDOW_MINUTES))
+
+    return JSONResponse({"message": "OTP verified successfully!"}, 200)
+
+
+async def signup(request):
+    if rate_limiter and not await run_in_threadpool(rate_limiter.hit, SIGNUP_LIMIT, "signup", request.client.host if request.client else ""):
+        return JSONResponse({
+            "success": False,
+            "message": "Rate limit exceeded. Please try again later."
+        }, 429)
+
+    data = await _json_body(request) or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return JSONResponse({"message": "Username and password are required"}, 400)
+
+    otp_record = await async_database.find_otp_for_signup(username)
+    if not otp_record or not otp_record.get("verified"):
+        return JSONResponse({"error": "OTP not verified. Please verify your email first."}, 403)
+
+    if await async_database.user_exists(hash_username(username)):
+        return JSONResponse({"error": "User already exists"}, 409)
+
+    user = UserSchema(username, password, hashed_password=await bcrypt_service.hash_async(password))
+    await async_database.insert_user(user.to_dict())
+    print(f"\nUser created: {user.user_id}")
+
+    return JSONResponse({
+        "message": "User created successfully!",
+        "user_id": user.user_id
+    }, 201)
+
+
+async def login(request):
+    data = await _json_body(request) or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return JSONResponse({"message": "Username and password are required"}, 400)
+
+    hashed_username = hash_username(username)
+    user_data = await async_database.find_user_for_login(hashed_username)
+    if not user_data:
+        return JSONResponse({"message": "User not found"}, 404)
+
+    decrypted_name = aes_decrypt(user_data['name'], MASTER_KEY)
+    if decrypted_name != username:
+        return JSONResponse({"message": "Invalid username"}, 401)
+
+    current_time = datetime.utcnow()
+
+    if user_data.get('account_locked_until'):
+        lock_time = user_data['account_locked_until']
+        if isinstance(lock_time, str):
+            lock_time = datetime.fromisoformat(lock_time)
+
+        if current_time < lock_time:
+            remaining_time = (lock_time - current_time).total_seconds() / 60
+            return JSONResponse({
+                "message": f"Account is temporarily locked. Please try again in {int(remaining_time)} minutes.",
+                "locked": True,
+                "lockout_remaining": int(remaining_time)
+            }, 403)
+
+    if not await bcrypt_service.check_async(password, user_data['password']):
+        lockout_time = current_time + timedelta(minutes=LOCKOUT_MINUTES)
+        new_attempt_count = await async_database.record_failed_login(
+            hashed_username, current_time, MAX_LOGIN_ATTEMPTS, lockout_time
+        )
+
+        if new_attempt_count is None or new_attempt_count >= MAX_LOGIN_ATTEMPTS:
+            return JSONResponse({
+                "message": f"Account locked due to too many failed attempts. Please try again after {LOCKOUT_MINUTES} minutes.",
+                "locked": True,
+                "lockout_remaining": LOCKOUT_MINUTES
+            }, 403)
+
+        remaining_attempts = MAX_LOGIN_ATTEMPTS - new_attempt_count
+        return JSONResponse({
+            "message": f"Invalid password. {remaining_attempts} attempts remaining before account lockout.",
+            "remaining_attempts": remaining_attempts
+        }, 401)
+
+    if user_data.get('failed_attempts') or user_data.get('account_locked_until'):
+        await async_database.reset_login_failures(hashed_username)
+
+    response = JSONResponse({"message": "Login successful", "username": decrypted_name}, 200)
+    response.set_cookie('token', create_login_token(user_data['user_id']),
+                        httponly=True, secure=True, samesite='strict', max_age=3600)
+    return response
+
+
+async def hashing_overloaded(request, exc):
+    return JSONResponse({
+        "success": False,
+        "message": "Server is busy, please try again shortly."
+    }, 503)
+
+
+# Same CORS policy the Flask app sets with flask_cors
+async_routes = Starlette(
+    routes=[
+        Route('/send-otp', send_otp, methods=['POST']),
+        Route('/verify-otp', verify_otp, methods=['POST']),
+        Route('/signup', signup, methods=['POST']),
+        Route('/login', login, methods=['POST']),
+    ],
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=['http://localhost:5173'],
+        allow_credentials=True,
+        allow_methods=['*'],
+        allow_headers=['*'],
+    )],
+    exception_handlers={HashingOverloaded: hashing_overloaded},
+)
+# Path -> route label, the same names the Flask endpoints report to /metrics
+ASYNC_PATHS = {'/send-otp': 'send_otp', '/verify-otp': 'verify_otp', '/signup': 'signup', '/login': 'login'}
+
+flask_routes = WSGIMiddleware(flask_app)
+
+
+async def application(scope, receive, send):
+    if scope["type"] != "http":
+        await async_routes(scope, receive, send)
+    elif scope["path"] not in ASYNC_PATHS:
+        await flask_routes(scope, receive, send)
+    else:
+        await _timed_async_route(scope, receive, send)
+
+
+# What the Flask before/after_request hooks do for their routes: label the
+# stage and Mongo spans with the route and record the request duration
+async def _timed_async_route(scope, receive, send):
+    route = ASYNC_PATHS[scope["path"]]
+    metrics.set_route(route)
+    status = 500
+
+    async def send_with_status(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    started = time.perf_counter()
+    try:
+        await async_routes(scope, receive, send_with_status)
+    finally:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=scope["method"],
+                                        status=status)
@@ -0,0 +1,80 @@
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient, ReturnDocument
+
+from database import (
+    FAILED_LOGIN_FIELDS, LOGIN_RESET, OTP_ATTEMPT_FIELDS, OTP_SIGNUP_FIELDS, OTP_VERIFY_FIELDS,
+    USER_LOGIN_FIELDS, attempts_after_failure, client_options, failed_login_update, otp_attempt_filter,
+    otp_verified_update,
+)
+from metrics import MongoCommandTimer
+
+load_dotenv()
+
+# Async twin of database.py for the ASGI serving mode. Same collections, same
+# projections and the same login update, run on PyMongo's asyncio client so a
+# request waiting on Mongo doesn't hold a thread.
+client = AsyncMongoClient(os.getenv("MONGO_URI"), event_listeners=[MongoCommandTimer()], **client_options())
+db = client["ImageClassification"]
+users = db["User"]
+otps = db["otps"]
+mail_queue = db["mail_queue"]
+
+
+async def ping():
+    await client.admin.command("ping")
+
+
+# Users
+async def find_user_for_login(username_hash):
+    return await users.find_one({"username_hash": username_hash}, USER_LOGIN_FIELDS)
+
+
+async def user_exists(username_hash):
+    return await users.find_one({"username_hash": username_hash}, {"_id": 1}) is not None
+
+
+async def insert_user(user_doc):
+    await users.insert_one(user_doc)
+
+
+async def record_failed_login(username_hash, now, max_attempts, locked_until):
+    query, pipeline = failed_login_update(username_hash, now, max_attempts, locked_until)
+    previous = await users.find_one_and_update(
+        query, pipeline, projection=FAILED_LOGIN_FIELDS, return_document=ReturnDocument.BEFORE
+    )
+    return attempts_after_failure(previous)
+
+
+async def reset_login_failures(username_hash):
+    await users.update_one({"username_hash": username_hash}, {"$set": LOGIN_RESET})
+
+
+# OTPs
+async def upsert_otp(email, fields):
+    await otps.update_one({"email": email}, {"$set": fields}, upsert=True)
+
+
+async def use_otp_attempt(email, now, max_attempts):
+    return await otps.find_one_and_update(
+        otp_attempt_filter(email, now, max_attempts), {"$inc": {"attempts": 1}}, OTP_ATTEMPT_FIELDS
+    )
+
+
+async def find_otp_for_verify(email):
+    return await otps.find_one({"email": email}, OTP_VERIFY_FIELDS)
+
+
+async def find_otp_for_signup(email, now=None):
+    return await otps.find_one({"email": email, "expiry": {"$gt": now or datetime.utcnow()}}, OTP_SIGNUP_FIELDS)
+
+
+async def mark_otp_verified(email, otp_digest, verified_until):
+    await otps.update_one({"email": email, "otp": otp_digest}, otp_verified_update(verified_until))
+
+
+# Mail
+async def enqueue_mail(job):
+    await mail_queue.insert_one(job)
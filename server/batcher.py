@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import numpy as np
+
+
+class BatcherFull(Exception):
+    pass
+
+
+# The result didn't come back within the caller's timeout. A BatcherFull, so
+# callers answer it the same way (503, try again shortly).
+class BatcherTimeout(BatcherFull):
+    pass
+
+
+# Collects single-image tensors from concurrent requests and runs them through
+# the model together. A batch is flushed when it reaches max_batch_size or when
+# the oldest request has waited max_wait_ms, whichever comes first.
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, max_queue=256, stats_window=200):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._recent = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._totals = {"batches": 0, "items": 0, "rejected": 0, "timed_out": 0, "skipped": 0}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._inputs = None  # reused (max_batch_size, H, W, C) buffer, only touched by the worker thread
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    # Queue one (1, H, W, C) or (H, W, C) tensor, the future resolves to its row of preds
+    def submit(self, img_array):
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((img_array, future, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._totals["rejected"] += 1
+            raise BatcherFull("Inference queue is full")
+        return future
+
+    def predict(self, img_array, timeout=None):
+        return self._wait([self.submit(img_array)], timeout)[0]
+
+    # Several images at once (/predict/batch). They are queued back to back, so
+    # up to max_batch_size of them go through the same forward pass.
+    def predict_many(self, batch, timeout=None):
+        return np.stack(self._wait([self.submit(row) for row in batch], timeout))
+
+    # On timeout the futures still waiting are cancelled, so the worker drops
+    # them instead of running the model for a request nobody is waiting on
+    def _wait(self, futures, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [
+                future.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+                for future in futures
+            ]
+        except FutureTimeout:
+            for future in futures:
+                future.cancel()
+            with self._stats_lock:
+                self._totals["timed_out"] += 1
+            raise BatcherTimeout("Inference did not answer in time")
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Past the deadline, still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Claim every future; the ones whose caller gave up are cancelled and skipped
+            collected = self._collect()
+            batch = [item for item in collected if item[1].set_running_or_notify_cancel()]
+            if len(batch) < len(collected):
+                with self._stats_lock:
+                    self._totals["skipped"] += len(collected) - len(batch)
+            if not batch:
+                continue
+            flushed_at = time.monotonic()
+            futures = [item[1] for item in batch]
+            try:
+                inputs = self._fill_inputs(batch)
+                preds = self.predict_fn(inputs)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            forward_ms = (time.monotonic() - flushed_at) * 1000
+
+            for i, future in enumerate(futures):
+                future.set_result(preds[i])
+
+            self._record(len(batch), (flushed_at - batch[0][2]) * 1000, forward_ms)
+
+    # Copy each request's row into the reused batch buffer instead of concatenating
+    def _fill_inputs(self, batch):
+        row_shape = np.shape(batch[0][0])[-3:]
+        dtype = np.asarray(batch[0][0]).dtype
+        if self._inputs is None or self._inputs.shape[1:] != row_shape or self._inputs.dtype != dtype:
+            self._inputs = np.empty((self.max_batch_size,) + row_shape, dtype=dtype)
+
+        inputs = self._inputs[:len(batch)]
+        for i, item in enumerate(batch):
+            np.copyto(inputs[i], np.reshape(item[0], row_shape))
+        return inputs
+
+    def _record(self, size, wait_ms, forward_ms):
+        with self._stats_lock:
+            self._totals["batches"] += 1
+            self._totals["items"] += size
+            self._recent.append((size, wait_ms, forward_ms))
+
+    # Batch timing and fill ratio over the last stats_window batches, for tuning
+    def stats(self):
+        with self._stats_lock:
+            recent = list(self._recent)
+            totals = dict(self._totals)
+
+        stats = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            **totals,
+        }
+        if recent:
+            sizes, waits, forwards = (np.array(column, dtype=float) for column in zip(*recent))
+            stats["recent"] = {
+                "batches": len(recent),
+                "avg_batch_size": float(sizes.mean()),
+                "avg_fill_ratio": float(sizes.mean() / self.max_batch_size),
+                "avg_wait_ms": float(waits.mean()),
+                "avg_forward_ms": float(forwards.mean()),
+                "p95_forward_ms": float(np.percentile(forwards, 95)),
+                "avg_forward_ms_per_item": float(forwards.sum() / sizes.sum()),
+            }
+        return stats
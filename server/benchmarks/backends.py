@@ -0,0 +1,144 @@
+# Accuracy parity, latency and memory of the model backends against Keras.
+# Convert first (python convert_model.py ...), then run from server/:
+#   python -m benchmarks.backends [--backends keras tflite onnx] [--images static/images]
+#                                 [--labeled DIR] [--limit 200] [--batch-sizes 1 16]
+# Every backend predicts the same images. Parity is top-1 agreement with Keras
+# per class (the class Keras picked); with --labeled DIR (one sub-directory per
+# class name) accuracy against the true labels is reported as well. Each
+# backend is loaded in its own process so memory figures don't mix.
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_backends import BACKEND_PATHS, CLASS_NAMES
+from preprocessing import preprocess_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def collect_images(images_dir, labeled_dir, limit):
+    samples = []
+    if labeled_dir:
+        for label, name in enumerate(CLASS_NAMES):
+            class_dir = os.path.join(labeled_dir, name)
+            if os.path.isdir(class_dir):
+                samples += [(os.path.join(class_dir, f), label) for f in sorted(os.listdir(class_dir))
+                            if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS][:limit]
+    else:
+        samples = [(os.path.join(images_dir, f), None) for f in sorted(os.listdir(images_dir))
+                   if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS][:limit]
+    return samples
+
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# Runs in a fresh child process per backend
+def measure(name, paths, batch_sizes, repeat):
+    from model_backends import load_backend
+
+    inputs = np.concatenate([preprocess_image(path) for path in paths])
+    rss_before = _status_mb("VmRSS")
+    start = time.perf_counter()
+    backend = load_backend(name)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    preds = np.concatenate([backend.predict(inputs[i:i + 16]) for i in range(0, len(inputs), 16)])
+
+    latency = {}
+    for size in batch_sizes:
+        batch = np.resize(inputs, (size,) + inputs.shape[1:])
+        backend.predict(batch)  # warm up this shape
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            backend.predict(batch)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        latency[size] = (samples[len(samples) // 2], samples[int(len(samples) * 0.95)])
+
+    return {
+        "preds": preds,
+        "load_ms": load_ms,
+        "model_rss_mb": _status_mb("VmRSS") - rss_before,
+        "peak_rss_mb": _status_mb("VmHWM"),
+        "latency": latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite", "onnx"], choices=list(BACKEND_PATHS))
+    parser.add_argument("--images", default="static/images")
+    parser.add_argument("--labeled", help="directory with one sub-directory of images per class name")
+    parser.add_argument("--limit", type=int, default=200, help="images (per class with --labeled)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = collect_images(args.images, args.labeled, args.limit)
+    if not samples:
+        raise SystemExit("No images to compare on")
+    paths = [path for path, _ in samples]
+    labels = np.array([label for _, label in samples]) if args.labeled else None
+
+    results = {}
+    for name in dict.fromkeys(["keras"] + args.backends):
+        if not os.path.exists(BACKEND_PATHS[name]):
+            print(f"Skipping {name}: {BACKEND_PATHS[name]} not found (run convert_model.py)")
+            continue
+        # Fork before anything here has started TF, each backend gets a clean process
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork")) as pool:
+            results[name] = pool.submit(measure, name, paths, args.batch_sizes, args.repeat).result()
+
+    if "keras" not in results:
+        raise SystemExit("The Keras model is needed as the reference")
+    reference = results["keras"]["preds"]
+    reference_top1 = reference.argmax(axis=1)
+
+    print(f"\n{len(paths)} images")
+    header = f"{'backend':8} {'file MB':>8} {'load ms':>8} {'model MB':>9} {'peak MB':>8} {'top-1 agree':>12} {'max |dp|':>9}"
+    for size in args.batch_sizes:
+        header += f" {'bs=' + str(size) + ' p50/p95 ms':>20}"
+    print(header)
+    for name, r in results.items():
+        agree = float((r["preds"].argmax(axis=1) == reference_top1).mean())
+        max_diff = float(np.abs(r["preds"] - reference).max())
+        line = (f"{name:8} {os.path.getsize(BACKEND_PATHS[name]) / 1e6:8.1f} {r['load_ms']:8.0f} "
+                f"{r['model_rss_mb']:9.1f} {r['peak_rss_mb']:8.1f} {agree:12.2%} {max_diff:9.4f}")
+        for size in args.batch_sizes:
+            p50, p95 = r["latency"][size]
+            line += f" {f'{p50:.1f}/{p95:.1f}':>20}"
+        print(line)
+
+    # Per class: agreement with Keras on the images Keras put in that class,
+    # and accuracy against the true label when the images are labeled
+    names = list(results)
+    print(f"\n{'class':18} {'n':>4} " + " ".join(f"{name + ' agree':>13}" for name in names if name != "keras")
+          + ("".join(f" {name + ' acc':>11}" for name in names) if labels is not None else ""))
+    for label, class_name in enumerate(CLASS_NAMES):
+        mask = reference_top1 == label
+        line = f"{class_name:18} {int(mask.sum()):4} "
+        line += " ".join(
+            f"{(results[name]['preds'][mask].argmax(axis=1) == label).mean():13.2%}" if mask.any() else f"{'-':>13}"
+            for name in names if name != "keras"
+        )
+        if labels is not None:
+            truth = labels == label
+            for name in names:
+                line += (f" {(results[name]['preds'][truth].argmax(axis=1) == label).mean():11.2%}"
+                         if truth.any() else f" {'-':>11}")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Cost of each bcrypt work factor and the throughput of the hashing pool.
+# Run from server/:
+#   python -m benchmarks.bcrypt_cost [--rounds 10 11 12 13] [--concurrency 32] [--jobs 64]
+import argparse
+import threading
+import time
+
+import bcrypt
+
+from hashing import BcryptService, HashingOverloaded
+
+
+def single_hash_ms(rounds, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        bcrypt.hashpw(b"benchmark-password", bcrypt.gensalt(rounds))
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def pool_throughput(rounds, concurrency, jobs):
+    service = BcryptService(rounds=rounds, queue_timeout=60)
+    service.start()
+    per_thread = jobs // concurrency
+    rejected = []
+
+    def worker():
+        for _ in range(per_thread):
+            try:
+                service.hash("benchmark-password")
+            except HashingOverloaded:
+                rejected.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * concurrency / elapsed, service.stats(), len(rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--jobs", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'1 hash ms':>10} {'pool hash/s':>12} {'avg wait ms':>12} {'avg hash ms':>12}")
+    for rounds in args.rounds:
+        per_second, stats, rejected = pool_throughput(rounds, args.concurrency, args.jobs)
+        recent = stats["recent"]
+        print(
+            f"{rounds:>6} {single_hash_ms(rounds):>10.1f} {per_second:>12.1f} "
+            f"{recent['avg_queue_wait_ms']:>12.1f} {recent['avg_hash_ms']:>12.1f}"
+            + (f"  ({rejected} rejected)" if rejected else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Latency of the Mongo queries behind each route, run through database.py.
+# Writes to a throwaway "ImageClassificationBench" database. Run from server/:
+#   python -m benchmarks.db_queries [--uri mongodb://localhost:27017] [--users 1000]
+# The default URI is an in-memory mongomock stand-in.
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": statistics.median(samples),
+        "p95_ms": samples[int(len(samples) * 0.95) - 1],
+        "max_ms": samples[-1],
+    }
+
+
+def seed(database, n_users, legacy_predictions):
+    blob = "x" * 40_000  # roughly one encrypted base64 image
+    database.users.insert_many([{
+        "user_id": f"user-{i}",
+        "username_hash": f"hash-{i}",
+        "name": "encrypted-name",
+        "password": "bcrypt-hash",
+        "created_at": datetime.utcnow(),
+        "failed_attempts": 0,
+        # Old-style documents still carry their embedded history
+        "predictions": [{"input_image": blob, "result": "r"}] * legacy_predictions,
+    } for i in range(n_users)])
+    database.otps.insert_many([{
+        "email": f"user{i}@example.com",
+        "otp": "hmac-digest",
+        "expiry": datetime.utcnow() + timedelta(minutes=1),
+        "created_at": datetime.utcnow(),
+        "attempts": 0,
+        "verified": True,
+    } for i in range(n_users)])
+    database.predictions.insert_many([{
+        "user_id": f"user-{i % n_users}",
+        "created_at": datetime.utcnow() - timedelta(seconds=i),
+        "input_image": blob,
+        "result": "r",
+        "image_url": "u",
+    } for i in range(n_users * 5)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="mongomock://")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--legacy-predictions", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["MONGO_URI"] = args.uri
+    import database
+
+    # Point the module at a throwaway database, every collection ensure_indexes touches included
+    bench_db = database.client["ImageClassificationBench"]
+    database.client.drop_database("ImageClassificationBench")
+    database.db = bench_db
+    database.users, database.otps, database.predictions = bench_db["User"], bench_db["otps"], bench_db["predictions"]
+    database.mail_queue, database.magic_links = bench_db["mail_queue"], bench_db["magic_links"]
+    database.prediction_cache = bench_db["prediction_cache"]
+    database.ensure_indexes()
+    seed(database, args.users, args.legacy_predictions)
+
+    def some_user():
+        return random.randrange(args.users)
+
+    routes = {
+        "login: find_user_for_login": lambda: database.find_user_for_login(f"hash-{some_user()}"),
+        "login: full document (before)": lambda: database.users.find_one({"username_hash": f"hash-{some_user()}"}),
+        "signup: user_exists": lambda: database.user_exists(f"hash-{some_user()}"),
+        "signup: find_otp_for_signup": lambda: database.find_otp_for_signup(f"user{some_user()}@example.com"),
+        "send-otp: upsert_otp": lambda: database.upsert_otp(f"user{some_user()}@example.com", {"attempts": 0}),
+        "verify-otp: find_otp_for_verify": lambda: database.find_otp_for_verify(f"user{some_user()}@example.com"),
+        "predictions: iter_predictions": lambda: list(database.iter_predictions(f"user-{some_user()}", 20)),
+    }
+
+    print(f"{'query':40} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, fn in routes.items():
+        result = timed(fn, args.repeat)
+        print(f"{name:40} {result['p50_ms']:8.3f} {result['p95_ms']:8.3f} {result['max_ms']:8.3f}")
+
+    database.client.drop_database("ImageClassificationBench")
+
+
+if __name__ == "__main__":
+    main()
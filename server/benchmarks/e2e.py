@@ -0,0 +1,410 @@
+# End-to-end benchmark of the server routes against local stand-ins, so runs
+# are reproducible and comparable between commits. Run from server/:
+#
+#   python -m benchmarks.e2e [--users 100] [--predictions 200] [--concurrency 16]
+#                            [--server flask|gunicorn] [--workers 1] [--json out.json]
+#
+# It starts the app in a subprocess with:
+#   - MongoDB: mongomock:// (in-process, one per worker) or --mongo-uri for a
+#     throwaway mongod (needed for gunicorn with more than one worker)
+#   - SMTP: a sink in this process that accepts every message and keeps the
+#     OTP it carries, so the verify step uses the real code
+#   - a tiny randomly initialized 15-class Keras model in place of the
+#     encrypted ResNet50, encrypted with a fresh key in a scratch directory
+#   - rate limits off (RATELIMIT_ENABLED=0), they would turn most requests into 429s
+#
+# then drives /send-otp, /verify-otp, /signup, /login and /predict for every
+# user in turn and reports throughput, p50/p95/p99 latency and the server's
+# peak RSS as JSON. The model is random, so /predict numbers are for the
+# serving path, not for ResNet50 inference.
+import argparse
+import asyncio
+import base64
+import email
+import io
+import json
+import os
+import re
+import secrets
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from benchmarks.loadtest import percentile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "Benchmark-password-1"
+OTP_PATTERN = re.compile(rb'class="otp">(\d{6})<')
+
+
+# Minimal SMTP server: enough of the protocol for smtplib (EHLO, AUTH PLAIN,
+# MAIL, RCPT, DATA, QUIT). Messages are parsed and the OTP kept per recipient.
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.otps = {}
+        self.received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+
+    def deliver(self, recipients, data):
+        message = email.message_from_bytes(data)
+        otp = None
+        for part in message.walk():
+            payload = part.get_payload(decode=True) or b""
+            match = OTP_PATTERN.search(payload)
+            if match:
+                otp = match.group(1).decode()
+                break
+        with self.lock:
+            self.received += 1
+            for recipient in recipients:
+                self.otps[recipient.lower()] = otp
+
+    def wait_for(self, recipients, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if all(recipient in self.otps for recipient in recipients):
+                    return True
+            time.sleep(0.05)
+        return False
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 sink ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply("250-sink")
+                self.reply("250 AUTH PLAIN")
+            elif command == b"AUTH":
+                self.reply("235 accepted")
+            elif command == b"RCPT":
+                recipients.append(line.split(b":", 1)[1].strip().strip(b"<>").decode())
+                self.reply("250 ok")
+            elif command == b"DATA":
+                self.reply("354 end with .")
+                lines = []
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line == b".\r\n":
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.deliver(recipients, b"".join(lines))
+                recipients = []
+                self.reply("250 queued")
+            elif command == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                # HELO, MAIL, RSET, NOOP
+                self.reply("250 ok")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Random weights, same input and output shape as the real model
+def write_tiny_model(workdir):
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+    import tensorflow as tf
+    from cryptography.fernet import Fernet
+
+    from decryption import encrypt_model_file
+
+    model = tf.keras.Sequential([
+        tf.keras.Input((256, 256, 3)),
+        tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(15, activation="softmax"),
+    ])
+    os.makedirs(os.path.join(workdir, "models"), exist_ok=True)
+    plain_path = os.path.join(workdir, "models", "plain.h5")
+    model.save(plain_path)
+    key = Fernet.generate_key()
+    with open(os.path.join(workdir, "model_secret.key"), "wb") as f:
+        f.write(key)
+    encrypt_model_file(plain_path, os.path.join(workdir, "models", "encrypted_model.h5"), key)
+    os.remove(plain_path)
+
+
+def server_env(args, port, smtp_port):
+    env = dict(os.environ)
+    env.pop("MODEL_BACKEND_PATH", None)
+    env.update({
+        "PYTHONPATH": SERVER_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "PYTHONUNBUFFERED": "1",
+        "TF_CPP_MIN_LOG_LEVEL": "3",
+        "PORT": str(port),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "WEB_CONCURRENCY": str(args.workers),
+        "MONGO_URI": args.mongo_uri,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_SSL": "0",
+        "SMTP_STARTTLS": "0",
+        "SMTP_EMAIL": "benchmark@example.com",
+        "SMTP_PASSWORD": "x",
+        "FLASK_SECRET_KEY": secrets.token_hex(32),
+        "AES_MASTER_KEY": base64.b64encode(os.urandom(16)).decode(),
+        "BASE_URL": f"http://127.0.0.1:{port}",
+        "RATELIMIT_ENABLED": "0",
+        "MODEL_BACKEND": "keras",
+        "PREDICTION_CACHE_SHARED": "0",
+    })
+    return env
+
+
+def start_server(args, workdir, port, smtp_port):
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(SERVER_DIR, "gunicorn.conf.py"), "app:app"]
+    else:
+        command = [sys.executable, "-c",
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    return subprocess.Popen(command, cwd=workdir, env=server_env(args, port, smtp_port),
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(base_url, process, workdir, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if httpx.get(base_url + "/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    with open(os.path.join(workdir, "server.log"), "rb") as f:
+        tail = f.read()[-3000:].decode(errors="replace")
+    raise SystemExit(f"Server did not become ready:\n{tail}")
+
+
+# The server and all its children (gunicorn workers, the inference process)
+def process_tree(pid):
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/task/{child}/children") as f:
+                pids += [int(p) for p in f.read().split()]
+        except OSError:
+            pass
+    return pids
+
+
+def _status_mb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def tree_memory_mb(pid, field):
+    return sum(_status_mb(p, field) for p in process_tree(pid))
+
+
+def random_jpeg(rng, size=(640, 480)):
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+# Sends one request per item with `concurrency` in flight; send(client, item)
+# returns the response and may record what later phases need from it
+async def run_phase(client, items, send, concurrency):
+    latencies = []
+    statuses = {}
+    errors = 0
+    pending = iter(items)
+
+    async def worker():
+        nonlocal errors
+        for item in pending:
+            start = time.perf_counter()
+            try:
+                response = await send(client, item)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def drive(base_url, sink, server_pid, args):
+    users = [f"bench-{i}-{secrets.token_hex(4)}@example.com" for i in range(args.users)]
+    tokens = {}
+    rng = np.random.default_rng(args.seed)
+    if args.cached:
+        images = [random_jpeg(rng)] * args.predictions
+    else:
+        images = [random_jpeg(rng) for _ in range(args.predictions)]
+
+    async def send_otp(client, user):
+        return await client.post("/send-otp", json={"username": user})
+
+    async def verify_otp(client, user):
+        return await client.post("/verify-otp", json={"username": user, "otp": sink.otps.get(user.lower())})
+
+    async def signup(client, user):
+        return await client.post("/signup", json={"username": user, "password": PASSWORD})
+
+    async def login(client, user):
+        response = await client.post("/login", json={"username": user, "password": PASSWORD})
+        # The cookie is marked Secure, pass it on by hand over plain http
+        if "token" in response.cookies:
+            tokens[user] = response.cookies["token"]
+        return response
+
+    async def predict(client, i):
+        token = tokens[users[i % len(users)]]
+        return await client.post("/predict", files={"image": (f"bench-{i}.jpg", images[i], "image/jpeg")},
+                                 headers={"Cookie": f"token={token}"})
+
+    phases = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        async def phase(name, items, send):
+            phases[name] = await run_phase(client, items, send, args.concurrency)
+            phases[name]["server_rss_mb"] = tree_memory_mb(server_pid, "VmRSS")
+            if not args.json:
+                r = phases[name]
+                print(f"{name:11} {r['requests']:6} {r['rps']:8.1f} {r['p50_ms'] or 0:8.1f} "
+                      f"{r['p95_ms'] or 0:8.1f} {r['p99_ms'] or 0:8.1f}  {r['statuses']}")
+
+        if not args.json:
+            print(f"{'route':11} {'reqs':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        await phase("send-otp", users, send_otp)
+        # OTPs expire after a minute, the sink has to have them all before verifying
+        if not sink.wait_for([user.lower() for user in users], timeout=args.mail_timeout):
+            print(f"Only {sink.received} of {len(users)} OTP emails arrived", file=sys.stderr)
+        await phase("verify-otp", users, verify_otp)
+        await phase("signup", users, signup)
+        await phase("login", users, login)
+        if not tokens:
+            raise SystemExit("No user could log in, see server.log")
+        users = [user for user in users if user in tokens]
+        await phase("predict", range(args.predictions), predict)
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--predictions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--cached", action="store_true", help="upload the same image every time (prediction cache hits)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--mail-timeout", type=float, default=30)
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    parser.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--json", nargs="?", const="-", help="write the report as JSON to a file, or stdout")
+    args = parser.parse_args()
+
+    if args.mongo_uri.startswith("mongomock://") and args.server == "gunicorn" and args.workers > 1:
+        raise SystemExit("Workers don't share a mongomock database, use --mongo-uri with a throwaway mongod")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="e2e-bench-")
+    os.makedirs(os.path.join(workdir, "static", "images"), exist_ok=True)
+    write_tiny_model(workdir)
+
+    sink = SmtpSink()
+    sink.start()
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = start_server(args, workdir, port, sink.port)
+    try:
+        start = time.perf_counter()
+        wait_ready(base_url, process, workdir, args.ready_timeout)
+        ready_s = time.perf_counter() - start
+        idle_rss = tree_memory_mb(process.pid, "VmRSS")
+        phases = asyncio.run(drive(base_url, sink, process.pid, args))
+        peak_rss = tree_memory_mb(process.pid, "VmHWM")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        sink.shutdown()
+
+    report = {
+        "config": {
+            "server": args.server, "workers": args.workers, "users": args.users,
+            "predictions": args.predictions, "concurrency": args.concurrency,
+            "mongo": "mongomock" if args.mongo_uri.startswith("mongomock://") else "mongod",
+            "cached_images": args.cached, "inference_mode": os.getenv("INFERENCE_MODE", "local"),
+        },
+        "ready_s": ready_s,
+        "emails_received": sink.received,
+        "idle_rss_mb": idle_rss,
+        "peak_rss_mb": peak_rss,
+        "routes": phases,
+        "workdir": workdir,
+    }
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    else:
+        print(f"ready after {ready_s:.1f}s, {sink.received} emails, "
+              f"server RSS idle {idle_rss:.0f} MB, peak {peak_rss:.0f} MB (sum over processes)")
+
+
+if __name__ == "__main__":
+    main()
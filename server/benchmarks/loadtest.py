@@ -0,0 +1,100 @@
+# Requests per second and latency percentiles for one or more running servers,
+# e.g. the sync Flask server against the ASGI mode:
+#
+#   python app.py                                              # :5000
+#   uvicorn asgi:application --port 5001 --workers 1
+#   python -m benchmarks.loadtest http://localhost:5000 http://localhost:5001 \
+#       --route login --concurrency 64 --requests 2000
+#
+# Run from server/. Needs httpx.
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+
+# Each scenario builds one request for a given worker and iteration
+SCENARIOS = {
+    # Unknown user: a Mongo read and no bcrypt, mostly I/O wait
+    "login": lambda i: ("POST", "/login", {"username": f"loadtest-{i}@example.com", "password": "x"}),
+    # Unknown OTP record: a Mongo read per request
+    "verify-otp": lambda i: ("POST", "/verify-otp", {"username": f"loadtest-{i}@example.com", "otp": "000000"}),
+    # OTP hash, an upsert and a queued email
+    "send-otp": lambda i: ("POST", "/send-otp", {"username": f"loadtest-{i}@example.com"}),
+    "healthz": lambda i: ("GET", "/healthz", None),
+}
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * p / 100))]
+
+
+async def run_load(base_url, make_request, concurrency, total, timeout=30):
+    latencies = []
+    statuses = {}
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                method, path, body = make_request(i)
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "url": base_url,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--route", choices=sorted(SCENARIOS), default="login")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    offset = random.randrange(1_000_000)
+    make_request = lambda i: SCENARIOS[args.route](offset + i)
+    results = [asyncio.run(run_load(url, make_request, args.concurrency, args.requests)) for url in args.urls]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"route={args.route} concurrency={args.concurrency} requests={args.requests}")
+    print(f"{'url':32} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for r in results:
+        print(f"{r['url']:32} {r['rps']:9.1f} {r['p50_ms'] or 0:9.1f} {r['p95_ms'] or 0:9.1f} "
+              f"{r['p99_ms'] or 0:9.1f} {r['errors']:7}")
+
+
+if __name__ == "__main__":
+    main()
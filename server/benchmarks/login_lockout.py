@@ -0,0 +1,67 @@
+# Fires parallel bad-password logins at one account and checks the lockout
+# engages exactly at MAX_LOGIN_ATTEMPTS. Run from server/:
+#   python -m benchmarks.login_lockout [--uri mongodb://localhost:27017] [--attempts 20]
+# Use a real mongod to exercise Mongo's atomicity; the mongomock default
+# only checks the logic.
+import argparse
+import os
+import sys
+import threading
+from collections import Counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="mongomock://")
+    parser.add_argument("--attempts", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["MONGO_URI"] = args.uri
+    # This checks the lockout, not load shedding: let every attempt queue for
+    # the bcrypt pool instead of some being turned away with a 503
+    os.environ.setdefault("BCRYPT_MAX_PENDING", str(args.attempts))
+    os.environ.setdefault("BCRYPT_QUEUE_TIMEOUT_MS", "60000")
+    import app
+    import database
+    from schema import UserSchema
+
+    username = "lockout-check@example.com"
+    database.users.delete_many({"username_hash": UserSchema(username, "x").username_hash})
+    user = UserSchema(username, "correct-password")
+    database.insert_user(user.to_dict())
+
+    barrier = threading.Barrier(args.attempts)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def attempt():
+        client = app.app.test_client()
+        barrier.wait()
+        response = client.post("/login", json={"username": username, "password": "wrong-password"})
+        with lock:
+            statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=attempt) for _ in range(args.attempts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    state = database.users.find_one({"user_id": user.user_id}, {"failed_attempts": 1, "account_locked_until": 1})
+    database.users.delete_one({"user_id": user.user_id})
+
+    print(f"responses: {dict(statuses)}")
+    print(f"failed_attempts={state.get('failed_attempts')} account_locked_until={state.get('account_locked_until')}")
+
+    ok = (
+        state.get("failed_attempts") == app.MAX_LOGIN_ATTEMPTS
+        and state.get("account_locked_until") is not None
+        and statuses[401] == app.MAX_LOGIN_ATTEMPTS - 1
+        and statuses[403] == args.attempts - (app.MAX_LOGIN_ATTEMPTS - 1)
+    )
+    print("OK" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
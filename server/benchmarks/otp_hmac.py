@@ -0,0 +1,94 @@
+# Cost of issuing and checking an OTP: the old bcrypt hash per code against
+# the keyed HMAC-SHA256 now stored, single-threaded ops/sec and per-op time,
+# plus the atomic verify update against a Mongo collection. Run from server/:
+#   python -m benchmarks.otp_hmac [--rounds 12] [--bcrypt-ops 10] [--ops 20000] [--records 2000]
+# Importing the app modules opens MONGO_URI, set MONGO_URI=mongomock:// offline
+# (the Mongo numbers then only show the in-process cost, not a round trip).
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+
+import database
+from hashing import BCRYPT_ROUNDS
+from OtpSchema import MAX_OTP_ATTEMPTS, OtpSchema, generate_otp, otp_matches
+
+
+def rate(fn, ops):
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    return ops / elapsed, elapsed / ops * 1e6
+
+
+def bcrypt_rows(rounds, ops):
+    otp = generate_otp().encode()
+    hashed = bcrypt.hashpw(otp, bcrypt.gensalt(rounds))
+    return [
+        (f"bcrypt({rounds}) issue", *rate(lambda i: bcrypt.hashpw(otp, bcrypt.gensalt(rounds)), ops)),
+        (f"bcrypt({rounds}) verify", *rate(lambda i: bcrypt.checkpw(otp, hashed), ops)),
+    ]
+
+
+def hmac_rows(ops):
+    email = "user@example.com"
+    otp = generate_otp()
+    stored = OtpSchema(None, email, otp).hashed_otp
+    return [
+        ("hmac issue", *rate(lambda i: OtpSchema(None, email, generate_otp()).to_dict(), ops)),
+        ("hmac verify", *rate(lambda i: otp_matches(stored, email, otp), ops)),
+    ]
+
+
+# One upsert per issue, one find_one_and_update plus the conditional verified
+# update per verify, on a scratch collection of `records` live codes
+def mongo_rows(records, ops):
+    collection = database.db[f"otp_benchmark_{int(time.time())}"]
+    codes = {}
+
+    def issue(i):
+        email = f"user{i % records}@example.com"
+        codes[email] = generate_otp()
+        doc = OtpSchema(None, email, codes[email]).to_dict()
+        collection.update_one({"email": email}, {"$set": doc}, upsert=True)
+
+    def verify(i):
+        email = f"user{i % records}@example.com"
+        now = datetime.utcnow()
+        record = collection.find_one_and_update(
+            database.otp_attempt_filter(email, now, MAX_OTP_ATTEMPTS), {"$inc": {"attempts": 1}},
+            database.OTP_ATTEMPT_FIELDS
+        )
+        if record and otp_matches(record["otp"], email, codes[email]):
+            collection.update_one({"email": email, "otp": record["otp"]},
+                                  database.otp_verified_update(now + timedelta(minutes=15)))
+        # Fresh code so the next verify of this email finds one with attempts left
+        collection.update_one({"email": email}, {"$set": {"attempts": 0, "verified": False}})
+
+    collection.create_index("email", unique=True)
+    try:
+        rows = [("mongo issue", *rate(issue, ops))]
+        rows.append(("mongo verify", *rate(verify, min(ops, records))))
+    finally:
+        collection.drop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    parser.add_argument("--bcrypt-ops", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = bcrypt_rows(args.rounds, args.bcrypt_ops) + hmac_rows(args.ops) + mongo_rows(args.records, args.records)
+    print(f"{'operation':20} {'ops/sec':>12} {'us/op':>10}")
+    for name, ops_per_sec, us in rows:
+        print(f"{name:20} {ops_per_sec:12.0f} {us:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Parity and speed check of preprocessing.preprocess_image against the
+# original full-decode path. Run from server/:
+#   python -m benchmarks.preprocess_parity [image ...]
+# A generated 4000x3000 JPEG is always included, the bundled images are too
+# small for draft decoding to kick in.
+import glob
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMAGE_SIZE, load_rgb, preprocess_image, preprocess_many
+
+# Max mean absolute pixel difference we accept from draft decoding (0-255 scale)
+MAX_MEAN_ABS_DIFF = 3.0
+
+
+# A phone-photo sized JPEG: smooth gradients with some noise and edges on top
+def large_jpeg(width=4000, height=3000):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    pixels += rng.normal(0, 12, pixels.shape)
+    pixels[::200] = 0
+    out = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+# The preprocessing /predict used before draft decoding, kept as the reference
+def legacy_preprocess(source):
+    img = Image.open(source).convert('RGB')
+    img = img.resize((256, 256))
+    img_array = np.array(img)
+    return np.expand_dims(img_array, axis=0)
+
+
+def timed(fn, data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(io.BytesIO(data))
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(paths, repeat=20):
+    failures = 0
+    sources = [(path, open(path, "rb").read()) for path in paths] + [("generated 4000x3000 JPEG", large_jpeg())]
+    for path, data in sources:
+        expected = legacy_preprocess(io.BytesIO(data))
+        actual = preprocess_image(io.BytesIO(data))
+
+        assert actual.shape == expected.shape and actual.dtype == expected.dtype
+        diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+        ok = diff.mean() <= MAX_MEAN_ABS_DIFF
+        failures += not ok
+
+        print(
+            f"{'ok  ' if ok else 'FAIL'} {path}: {Image.open(io.BytesIO(data)).size} "
+            f"mean_abs_diff={diff.mean():.3f} max_abs_diff={diff.max()} "
+            f"legacy={timed(legacy_preprocess, data, repeat):.2f}ms "
+            f"new={timed(preprocess_image, data, repeat):.2f}ms"
+        )
+
+    # The large JPEG must actually have gone through the draft path, and stayed within bounds
+    path, data = sources[-1]
+    assert load_rgb(io.BytesIO(data)).size < Image.open(io.BytesIO(data)).size, "draft decoding not used"
+    assert ok, f"{path}: mean_abs_diff={diff.mean():.3f} above {MAX_MEAN_ABS_DIFF}"
+
+    # /predict/batch decodes into the rows of one array, that must match the single-image path
+    batch = np.empty((len(sources), IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        errors = preprocess_many([io.BytesIO(data) for _, data in sources], batch, executor)
+    for i, (path, data) in enumerate(sources):
+        assert errors[i] is None, (path, errors[i])
+        assert np.array_equal(batch[i], preprocess_image(io.BytesIO(data))[0]), path
+
+    return failures
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob("static/images/*.jpg") + glob.glob("static/images/*.png"))
+    sys.exit(1 if main(paths) else 0)
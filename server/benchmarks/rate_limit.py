@@ -0,0 +1,91 @@
+# Per-request overhead of the rate limiter for each storage backend: the same
+# tiny Flask route with and without a limit, anonymous (keyed by IP) and
+# signed in (JWT decoded for the per-user key), plus the raw counter round
+# trip. Run from server/:
+#   python -m benchmarks.rate_limit [--requests 5000]
+#       [--mongo-uri mongodb://localhost:27017] [--redis-uri redis://localhost:6379]
+# memory:// is always measured; Mongo and Redis only when their URI is given
+# (point them at throwaway servers, the benchmark writes counters there).
+# Importing the app modules opens MONGO_URI, set MONGO_URI=mongomock:// offline.
+import argparse
+import time
+import uuid
+
+import jwt
+from flask import Flask
+
+from rate_limits import create_limiter
+
+SECRET = "rate-limit-benchmark"
+
+
+def build_app(storage_uri):
+    app = Flask(__name__)
+    app.secret_key = SECRET
+    limiter = create_limiter(app, storage_uri)
+
+    @app.route("/free")
+    def free():
+        return "ok"
+
+    # High enough never to trip, every request still increments a counter
+    @app.route("/limited")
+    @limiter.limit("100000000 per day")
+    def limited():
+        return "ok"
+
+    return app, limiter
+
+
+def per_request_us(client, path, requests, cookie=None):
+    if cookie:
+        client.set_cookie("token", cookie)
+    else:
+        client.delete_cookie("token")
+    for _ in range(min(200, requests)):
+        client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return elapsed / requests * 1e6
+
+
+def incr_latency_us(storage, requests):
+    key = f"benchmark/{uuid.uuid4()}"
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        storage.incr(key, 60)
+        samples.append((time.perf_counter() - start) * 1e6)
+    storage.clear(key)
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--mongo-uri")
+    parser.add_argument("--redis-uri")
+    args = parser.parse_args()
+
+    uris = ["memory://"] + [uri for uri in (args.mongo_uri, args.redis_uri) if uri]
+    token = jwt.encode({"user_id": str(uuid.uuid4())}, SECRET, algorithm="HS256")
+
+    print(f"{args.requests} requests per cell, microseconds per request")
+    print(f"{'storage':24} {'no limit':>9} {'anon':>9} {'+anon':>8} {'user':>9} {'+user':>8} {'incr p50':>9} {'incr p99':>9}")
+    for uri in uris:
+        app, limiter = build_app(uri)
+        client = app.test_client()
+        base = per_request_us(client, "/free", args.requests)
+        anon = per_request_us(client, "/limited", args.requests)
+        user = per_request_us(client, "/limited", args.requests, cookie=token)
+        p50, p99 = incr_latency_us(limiter.storage, args.requests)
+        print(f"{uri.split('@')[-1][:24]:24} {base:9.1f} {anon:9.1f} {anon - base:8.1f} {user:9.1f} {user - base:8.1f} "
+              f"{p50:9.1f} {p99:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
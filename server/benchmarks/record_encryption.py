@@ -0,0 +1,82 @@
+# Storage size and encrypt/decrypt throughput of a prediction document: the
+# old per-field aes_encrypt scheme (image base64'd before and after encryption)
+# against the sealed envelope format. Needs AES_MASTER_KEY (.env). Run from server/:
+#   python -m benchmarks.record_encryption [--image-kb 50 200 1000] [--repeat 200]
+import argparse
+import base64
+import os
+import time
+from datetime import datetime
+
+import bson
+
+from schema import MASTER_KEY, PredictionSchema, aes_decrypt, aes_encrypt, read_prediction, read_prediction_image
+
+USER_ID = "2f1d7c1e-5a9b-4c3e-9a57-0c5d1e7b9f42"
+RESULT = "table_tennis_ball"
+IMAGE_URL = "http://localhost:5000/static/images/IMG_20260101_120000.jpg"
+
+
+def old_document(image_bytes, created_at):
+    return {
+        "user_id": USER_ID,
+        "created_at": created_at,
+        "input_image": aes_encrypt(base64.b64encode(image_bytes).decode(), MASTER_KEY),
+        "result": aes_encrypt(RESULT, MASTER_KEY),
+        "image_url": aes_encrypt(IMAGE_URL, MASTER_KEY),
+        "predicted_at": aes_encrypt(created_at.isoformat(), MASTER_KEY),
+    }
+
+
+def old_read(doc):
+    return aes_decrypt(doc["result"], MASTER_KEY), aes_decrypt(doc["image_url"], MASTER_KEY)
+
+
+def old_read_image(doc):
+    return base64.b64decode(aes_decrypt(doc["input_image"], MASTER_KEY))
+
+
+def new_document(image_bytes, created_at):
+    return PredictionSchema(USER_ID, image_bytes, RESULT, IMAGE_URL, created_at).to_dict()
+
+
+def new_read(doc):
+    return read_prediction(doc, USER_ID)
+
+
+def new_read_image(doc):
+    return read_prediction_image(doc, USER_ID)
+
+
+def per_second(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-kb", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    created_at = datetime.utcnow()
+    print(f"{'image':>8} {'scheme':7} {'stored KB':>10} {'overhead':>9} {'write/s':>9} {'list read/s':>12} {'image read/s':>13}")
+    for kb in args.image_kb:
+        image_bytes = os.urandom(kb * 1024)
+        for name, write, read, read_image in (
+            ("old", old_document, old_read, old_read_image),
+            ("sealed", new_document, new_read, new_read_image),
+        ):
+            doc = write(image_bytes, created_at)
+            assert read_image(doc) == image_bytes
+            stored = len(bson.encode(doc))
+            print(f"{kb:6}KB {name:7} {stored / 1024:10.1f} {stored / len(image_bytes) - 1:9.1%} "
+                  f"{per_second(lambda: write(image_bytes, created_at), args.repeat):9.0f} "
+                  f"{per_second(lambda: read(doc), args.repeat * 10):12.0f} "
+                  f"{per_second(lambda: read_image(doc), args.repeat):13.0f}")
+
+
+if __name__ == "__main__":
+    main()
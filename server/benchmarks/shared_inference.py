@@ -0,0 +1,121 @@
+# Memory and latency of N workers that each load the model (INFERENCE_MODE=local)
+# against N workers sharing one inference process (INFERENCE_MODE=shared).
+# Needs the encrypted model and key in place. Run from server/:
+#   python -m benchmarks.shared_inference [--workers 4] [--threads 4] [--requests 50]
+# Memory is PSS, so pages shared between processes are only counted once overall.
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+from inference_server import SharedInference
+
+
+def pss_mb(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def local_predictor(intra_threads):
+    # Each local worker gets its share of the cores, like gunicorn.conf.py sets up.
+    # Imported here so TF only starts after the fork.
+    os.environ.setdefault("TF_INTRA_OP_THREADS", str(intra_threads))
+    os.environ.setdefault("TF_INTER_OP_THREADS", "1")
+    from batcher import MicroBatcher
+    from decryption import load_model
+    model = load_model()
+    batcher = MicroBatcher(lambda batch: model.predict(batch, verbose=0))
+    return lambda img: batcher.predict(img, timeout=60)
+
+
+def worker(make_predict, threads, requests, results, go, measured):
+    predict = make_predict()
+    image = np.random.randint(0, 256, (1, 256, 256, 3), dtype=np.uint8)
+    # Warm up, in shared mode this also waits for the inference process to load the model
+    predict(image)
+    results.put(("ready", os.getpid()))
+    go.wait()
+
+    latencies = []
+
+    def run():
+        for _ in range(requests):
+            start = time.perf_counter()
+            predict(image)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    results.put(("done", os.getpid(), latencies))
+    measured.wait()
+
+
+def run_mode(name, make_predict, workers, threads, requests, extra_pids=()):
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.SimpleQueue()
+    go, measured = ctx.Event(), ctx.Event()
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker(make_predict, threads, requests, results, go, measured)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    for _ in pids:
+        results.get()
+    start = time.perf_counter()
+    go.set()
+    latencies = []
+    for _ in pids:
+        latencies += results.get()[2]
+    elapsed = time.perf_counter() - start
+
+    # Sample while everything is still alive
+    worker_mb = sum(pss_mb(pid) for pid in pids)
+    extra_mb = sum(pss_mb(pid) for pid in extra_pids)
+    measured.set()
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    latencies.sort()
+    print(f"{name:7} workers={workers} total PSS {worker_mb + extra_mb:8.1f} MB "
+          f"(workers {worker_mb:.1f}, inference {extra_mb:.1f})  "
+          f"{len(latencies) / elapsed:7.1f} img/s  "
+          f"p50 {latencies[len(latencies) // 2]:.1f} ms  p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="concurrent requests per worker")
+    parser.add_argument("--requests", type=int, default=50, help="requests per thread")
+    args = parser.parse_args()
+
+    intra_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    run_mode("local", partial(local_predictor, intra_threads), args.workers, args.threads, args.requests)
+
+    shared = SharedInference(slots=args.workers * args.threads * 2).start()
+    try:
+        run_mode("shared", lambda: (lambda img: shared.predict(img, timeout=60)),
+                 args.workers, args.threads, args.requests, extra_pids=[shared.pid])
+    finally:
+        shared.stop()
+
+
+if __name__ == "__main__":
+    main()
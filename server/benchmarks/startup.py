@@ -0,0 +1,89 @@
+# Cold start cost of a worker: how long `import app` takes, whether it pulled
+# in TensorFlow, how long until /readyz answers 200, and how long until the
+# first /predict comes back when it is sent right after the import. Every run
+# is a fresh interpreter. Run from server/:
+#   python -m benchmarks.startup [--runs 5] [--image static/images/ball.jpg] [--json]
+# MONGO_URI=mongomock:// keeps the database out of the numbers.
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import io, json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+tensorflow_at_import = "tensorflow" in sys.modules
+
+client = app.app.test_client()
+client.set_cookie("token", app.create_login_token("startup-benchmark"))
+with open(sys.argv[1], "rb") as f:
+    image = f.read()
+response = client.post("/predict", data={"image": (io.BytesIO(image), "startup.jpg")},
+                       content_type="multipart/form-data")
+first_prediction = time.perf_counter()
+
+deadline = first_prediction + float(sys.argv[2])
+while client.get("/readyz").status_code != 200 and time.perf_counter() < deadline:
+    time.sleep(0.01)
+ready = time.perf_counter() if app.warmup.ready() else None
+
+print(json.dumps({
+    "import_s": imported - start,
+    "first_prediction_s": first_prediction - start,
+    "first_prediction_status": response.status_code,
+    "ready_s": None if ready is None else ready - start,
+    "tensorflow_at_import": tensorflow_at_import,
+}))
+"""
+
+
+def run_once(image, ready_timeout):
+    result = subprocess.run([sys.executable, "-c", CHILD, image, str(ready_timeout)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Startup run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    if not values:
+        return None
+    return {"median": statistics.median(values), "min": min(values), "max": max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--image", default="static/images/ball.jpg")
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    runs = [run_once(args.image, args.ready_timeout) for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "import_s": summarize(runs, "import_s"),
+        "first_prediction_s": summarize(runs, "first_prediction_s"),
+        "ready_s": summarize(runs, "ready_s"),
+        "first_prediction_statuses": sorted({run["first_prediction_status"] for run in runs}),
+        "tensorflow_at_import": any(run["tensorflow_at_import"] for run in runs),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.runs} cold starts (median, min-max)")
+    for key, label in (("import_s", "import app"), ("first_prediction_s", "first /predict"), ("ready_s", "/readyz 200")):
+        stats = report[key]
+        print(f"  {label:16} " + ("never" if stats is None else
+                                  f"{stats['median']:.2f}s ({stats['min']:.2f}-{stats['max']:.2f}s)"))
+    print(f"  first /predict status: {report['first_prediction_statuses']}")
+    print(f"  TensorFlow imported by `import app`: {report['tensorflow_at_import']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Memory and latency of the magic-link token stores as they fill up: bytes
+# per token and issue/consume time of the in-process store at each size, and
+# the same latencies against a Mongo collection holding that many tokens.
+# Run from server/:
+#   python -m benchmarks.token_store [--tokens 100000 1000000 2000000]
+#       [--mongo-uri mongodb://localhost:27017]
+# The Mongo store is only measured when a URI is given (point it at a
+# throwaway server, the benchmark fills and then drops a scratch collection).
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from itsdangerous import URLSafeTimedSerializer
+from pymongo import ASCENDING, MongoClient
+
+from token_store import MemoryTokenStore, MongoTokenStore, token_key
+
+SAMPLES = 5000
+
+
+def make_tokens(count):
+    serializer = URLSafeTimedSerializer("token-store-benchmark")
+    return [serializer.dumps(f"user{i}@example.com", salt="magic-link") for i in range(count)]
+
+
+def percentiles(samples):
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def timed_us(fn, args):
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+
+# Store filled with live tokens: consume latency for `hits` it holds and for
+# tokens it never saw (misses), then issue latency for new tokens
+def latency_row(store, hits, fresh):
+    consume_hit = timed_us(store.consume, hits)
+    consume_miss = timed_us(store.consume, fresh[:SAMPLES])
+    issue = timed_us(lambda token: store.issue(token, "user@example.com"), fresh[SAMPLES:2 * SAMPLES])
+    return issue, consume_hit, consume_miss
+
+
+def filled_store(tokens, count):
+    store = MemoryTokenStore(ttl_seconds=3600, max_entries=count)
+    emails = [f"user{i}@example.com" for i in range(count)]
+    start = time.perf_counter()
+    for token, email in zip(tokens, emails):
+        store.issue(token, email)
+    return store, (time.perf_counter() - start) / count * 1e6
+
+
+def memory_rows(sizes, tokens, fresh):
+    rows = []
+    for count in sizes:
+        # Sized on a second store, tracemalloc would slow the timed fill down
+        tracemalloc.start()
+        filled_store(tokens, count)
+        bytes_per_token = tracemalloc.get_traced_memory()[1] / count
+        tracemalloc.stop()
+
+        store, fill_us = filled_store(tokens, count)
+        hits = random.sample(tokens[:count], min(SAMPLES, count))
+        rows.append((f"memory {count:,}", fill_us, bytes_per_token, *latency_row(store, hits, fresh)))
+    return rows
+
+
+def token_docs(tokens, first, expire_at):
+    return [{"_id": token_key(token), "email": f"user{first + i}@example.com", "expire_at": expire_at}
+            for i, token in enumerate(tokens)]
+
+
+def mongo_rows(uri, sizes, tokens, fresh):
+    client = MongoClient(uri)
+    db = client["ImageClassification"]
+    collection = db[f"magic_links_benchmark_{int(time.time())}"]
+    collection.create_index([("expire_at", ASCENDING)], expireAfterSeconds=0)
+    store = MongoTokenStore(collection, ttl_seconds=3600)
+    expire_at = datetime.utcnow() + timedelta(hours=1)
+    rows = []
+    filled = 0
+    try:
+        for count in sizes:
+            # Bulk fill up to this size, then time single operations
+            start = time.perf_counter()
+            for offset in range(filled, count, 10000):
+                collection.insert_many(token_docs(tokens[offset:min(count, offset + 10000)], offset, expire_at),
+                                       ordered=False)
+            fill_us = (time.perf_counter() - start) / (count - filled) * 1e6
+            filled = count
+            stats = db.command("collStats", collection.name)
+            bytes_per_token = (stats["size"] + stats["totalIndexSize"]) / count
+
+            hit_indexes = random.sample(range(count), min(SAMPLES, count))
+            row = latency_row(store, [tokens[i] for i in hit_indexes], fresh)
+            rows.append((f"mongo {count:,}", fill_us, bytes_per_token, *row))
+
+            # Back to exactly the first `count` tokens for the next size
+            collection.delete_many({"_id": {"$in": [token_key(token) for token in fresh[SAMPLES:2 * SAMPLES]]}})
+            collection.insert_many([token_docs([tokens[i]], i, expire_at)[0] for i in hit_indexes], ordered=False)
+    finally:
+        collection.drop()
+        client.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, nargs="+", default=[100000, 1000000, 2000000])
+    parser.add_argument("--mongo-uri")
+    args = parser.parse_args()
+
+    sizes = sorted(args.tokens)
+    print(f"generating {sizes[-1] + 2 * SAMPLES:,} tokens...")
+    tokens = make_tokens(sizes[-1] + 2 * SAMPLES)
+    tokens, fresh = tokens[:sizes[-1]], tokens[sizes[-1]:]
+
+    rows = memory_rows(sizes, tokens, fresh)
+    if args.mongo_uri:
+        rows += mongo_rows(args.mongo_uri, sizes, tokens, fresh)
+
+    print(f"{'store':18} {'fill us':>8} {'B/token':>8} {'issue p50':>10} {'p99':>8} "
+          f"{'hit p50':>8} {'p99':>8} {'miss p50':>9} {'p99':>8}")
+    for name, fill_us, bytes_per_token, issue, hit, miss in rows:
+        print(f"{name:18} {fill_us:8.2f} {bytes_per_token:8.0f} {issue[0]:10.2f} {issue[1]:8.2f} "
+              f"{hit[0]:8.2f} {hit[1]:8.2f} {miss[0]:9.2f} {miss[1]:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
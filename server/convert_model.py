@@ -0,0 +1,114 @@
+# Convert the encrypted Keras model into a faster CPU backend and encrypt the
+# result with the same key, for MODEL_BACKEND=tflite / onnx. Run from server/:
+#
+#   python convert_model.py tflite --quantize dynamic
+#   python convert_model.py onnx --quantize int8 --calibration-dir static/images
+#
+# --quantize none     float32 weights, closest to the Keras model
+# --quantize dynamic  int8 weights, float activations (no calibration needed)
+# --quantize int8     int8 weights and activations, calibrated on sample images
+#
+# Inputs and outputs stay float32 in every mode, so the serving code is the same.
+# Check the result with `python -m benchmarks.backends` before switching over.
+import argparse
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from decryption import ENCRYPTED_MODEL_PATH, encrypt_model_stream, load_encryption_key, load_model
+from model_backends import BACKEND_PATHS
+from preprocessing import IMAGE_SIZE, preprocess_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def calibration_batches(directory, limit):
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )[:limit]
+    if not paths:
+        raise SystemExit(f"No calibration images (jpg/png) found in {directory}")
+    print(f"Calibrating on {len(paths)} images from {directory}")
+    for path in paths:
+        yield preprocess_image(path).astype(np.float32)
+
+
+def to_tflite(model, quantize, calibration):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "int8":
+        converter.representative_dataset = lambda: ([batch] for batch in calibration())
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def to_onnx(model, quantize, calibration):
+    import tensorflow as tf
+    try:
+        import onnx
+        import tf2onnx
+    except ImportError as e:
+        raise SystemExit("ONNX conversion needs the tf2onnx and onnx packages") from e
+
+    # tf2onnx can't read Keras 3 models directly, trace the forward pass instead
+    signature = (tf.TensorSpec((None, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), tf.float32, name="input"),)
+    forward = tf.function(lambda images: model(images, training=False))
+    proto, _ = tf2onnx.convert.from_function(forward, input_signature=signature, opset=17)
+    if quantize == "none":
+        return proto.SerializeToString()
+
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = ({"input": batch} for batch in calibration())
+
+        def get_next(self):
+            return next(self._batches, None)
+
+    # The quantizer only works on files, keep them in a private temp dir for as short as possible
+    with tempfile.TemporaryDirectory() as workdir:
+        float_path = os.path.join(workdir, "float.onnx")
+        quant_path = os.path.join(workdir, "quant.onnx")
+        onnx.save(proto, float_path)
+        if quantize == "dynamic":
+            quantize_dynamic(float_path, quant_path, weight_type=QuantType.QInt8)
+        else:
+            quantize_static(float_path, quant_path, Reader(), quant_format=QuantFormat.QDQ,
+                            weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+        with open(quant_path, "rb") as f:
+            return f.read()
+
+
+CONVERTERS = {"tflite": to_tflite, "onnx": to_onnx}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the encrypted Keras model for another backend")
+    parser.add_argument("backend", choices=sorted(CONVERTERS))
+    parser.add_argument("--quantize", choices=["none", "dynamic", "int8"], default="dynamic")
+    parser.add_argument("--src", default=ENCRYPTED_MODEL_PATH, help="encrypted Keras model")
+    parser.add_argument("--out", help="encrypted output file (defaults to the backend's usual path)")
+    parser.add_argument("--calibration-dir", default="static/images")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    args = parser.parse_args()
+
+    out = args.out or BACKEND_PATHS[args.backend]
+    model = load_model(args.src)
+    converted = CONVERTERS[args.backend](
+        model, args.quantize, lambda: calibration_batches(args.calibration_dir, args.calibration_samples)
+    )
+
+    # Encrypted like encryptModel.py, the plaintext stays in memory
+    encrypt_model_stream(io.BytesIO(converted), out, load_encryption_key())
+    print(f"{args.backend} model ({args.quantize}, {len(converted) / 1e6:.1f} MB) encrypted and saved as {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument
+from pymongo.errors import PyMongoError
+
+from metrics import MongoCommandTimer
+
+load_dotenv()
+
+
+# Explicit pool and timeouts, so a slow or unreachable cluster fails
+# requests quickly instead of hanging workers
+def client_options():
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000)),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000)),
+    }
+
+
+# MongoDB Atlas connection. A "mongomock://" URI swaps in an in-memory
+# stand-in for local benchmarks.
+def create_client(uri=None):
+    uri = uri or os.getenv("MONGO_URI")
+    if uri and uri.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient()
+
+    # Every command's round trip goes to the mongo_command_duration_seconds histogram
+    return MongoClient(uri, event_listeners=[MongoCommandTimer()], **client_options())
+
+
+client = create_client()
+db = client["ImageClassification"]
+users = db["User"]
+otps = db["otps"]
+predictions = db["predictions"]
+mail_queue = db["mail_queue"]
+magic_links = db["magic_links"]
+# Shared tier of the prediction cache (PREDICTION_CACHE_SHARED=1)
+prediction_cache = db["prediction_cache"]
+PREDICTION_CACHE_TTL_SECONDS = int(os.getenv("PREDICTION_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+# Only the fields each route actually reads
+USER_LOGIN_FIELDS = {"_id": 0, "user_id": 1, "name": 1, "password": 1,
+                     "failed_attempts": 1, "account_locked_until": 1}
+OTP_VERIFY_FIELDS = {"_id": 0, "expiry": 1, "attempts": 1}
+OTP_ATTEMPT_FIELDS = {"_id": 0, "otp": 1}
+OTP_SIGNUP_FIELDS = {"_id": 0, "verified": 1}
+# record holds result and image_url sealed together, older documents have them as separate fields
+PREDICTION_LIST_FIELDS = {"record": 1, "result": 1, "image_url": 1, "created_at": 1}
+PREDICTION_IMAGE_FIELDS = {"image": 1, "input_image": 1}
+
+
+
+def ping():
+    client.admin.command("ping")
+
+
+# Create the unique and TTL indexes the queries below rely on. Safe to run on
+# every start, create_index is a no-op when the index already exists.
+def ensure_indexes():
+    indexes = [
+        (users, [("username_hash", ASCENDING)], {"unique": True}),
+        (users, [("user_id", ASCENDING)], {"unique": True}),
+        (otps, [("email", ASCENDING)], {"unique": True}),
+        # OTP records go once they expire (verified ones after the signup window)
+        (otps, [("expiry", ASCENDING)], {"expireAfterSeconds": 0}),
+        (predictions, [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+        (mail_queue, [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+        (mail_queue, [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        (prediction_cache, [("created_at", ASCENDING)], {"expireAfterSeconds": PREDICTION_CACHE_TTL_SECONDS}),
+        # Shared one-time login tokens (MAGIC_LINK_STORE=mongo)
+        (magic_links, [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as e:
+            print(f"Could not create index {keys} on {collection.name}: {e}")
+
+    # Replaced by the TTL on expiry
+    try:
+        if "created_at_1" in otps.index_information():
+            otps.drop_index("created_at_1")
+    except PyMongoError as e:
+        print(f"Could not drop the old OTP TTL index: {e}")
+
+
+# Users
+def find_user_for_login(username_hash):
+    return users.find_one({"username_hash": username_hash}, USER_LOGIN_FIELDS)
+
+
+def user_exists(username_hash):
+    return users.find_one({"username_hash": username_hash}, {"_id": 1}) is not None
+
+
+def insert_user(user_doc):
+    users.insert_one(user_doc)
+
+
+# Count a failed login and lock the account once it reaches max_attempts, in
+# one atomic update. A lock that has already run out starts a fresh count.
+# Accounts that are locked right now don't match the filter at all.
+def failed_login_update(username_hash, now, max_attempts, locked_until):
+    lock = {"$ifNull": ["$account_locked_until", None]}
+    lock_expired = {"$and": [{"$ne": [lock, None]}, {"$lte": [lock, now]}]}
+    query = {
+        "username_hash": username_hash,
+        "$or": [{"account_locked_until": None}, {"account_locked_until": {"$lte": now}}]
+    }
+    pipeline = [
+        {"$set": {
+            "failed_attempts": {"$add": [
+                {"$cond": [lock_expired, 0, {"$ifNull": ["$failed_attempts", 0]}]}, 1
+            ]},
+            "last_failed_attempt": now,
+            "account_locked_until": {"$cond": [lock_expired, None, lock]}
+        }},
+        {"$set": {"account_locked_until": {"$cond": [
+            {"$gte": ["$failed_attempts", max_attempts]}, locked_until, "$account_locked_until"
+        ]}}}
+    ]
+    return query, pipeline
+
+
+# Same arithmetic as the update, done on the pre-image because the post-image
+# no longer matches the filter once the account is locked. None means the
+# account was locked by a concurrent attempt after the caller read it.
+def attempts_after_failure(previous):
+    if previous is None:
+        return None
+    if previous.get("account_locked_until") is not None:
+        return 1
+    return previous.get("failed_attempts", 0) + 1
+
+
+FAILED_LOGIN_FIELDS = {"failed_attempts": 1, "account_locked_until": 1}
+LOGIN_RESET = {"failed_attempts": 0, "last_failed_attempt": None, "account_locked_until": None}
+
+
+# Returns the new attempt count, or None when a concurrent attempt locked the account
+def record_failed_login(username_hash, now, max_attempts, locked_until):
+    query, pipeline = failed_login_update(username_hash, now, max_attempts, locked_until)
+    previous = users.find_one_and_update(
+        query, pipeline, projection=FAILED_LOGIN_FIELDS, return_document=ReturnDocument.BEFORE
+    )
+    return attempts_after_failure(previous)
+
+
+def reset_login_failures(username_hash):
+    users.update_one({"username_hash": username_hash}, {"$set": LOGIN_RESET})
+
+
+# OTPs. Issuing is one upsert that replaces code, expiry, attempts and the
+# verified flag together.
+def upsert_otp(email, fields):
+    otps.update_one({"email": email}, {"$set": fields}, upsert=True)
+
+
+# An attempt is counted before the code is compared, in one atomic update that
+# only matches a live record with attempts left, so parallel guesses can't
+# test more than max_attempts codes between them. Shared with async_database.
+def otp_attempt_filter(email, now, max_attempts):
+    return {"email": email, "expiry": {"$gt": now}, "attempts": {"$lt": max_attempts}}
+
+
+def otp_verified_update(verified_until):
+    return {"$set": {"verified": True, "attempts": 0, "expiry": verified_until}}
+
+
+# Stored digest of a live OTP with an attempt now used up, None when there
+# is no such record (find_otp_for_verify tells missing, expired and locked apart)
+def use_otp_attempt(email, now, max_attempts):
+    return otps.find_one_and_update(
+        otp_attempt_filter(email, now, max_attempts), {"$inc": {"attempts": 1}}, OTP_ATTEMPT_FIELDS
+    )
+
+
+def find_otp_for_verify(email):
+    return otps.find_one({"email": email}, OTP_VERIFY_FIELDS)
+
+
+def find_otp_for_signup(email, now=None):
+    return otps.find_one({"email": email, "expiry": {"$gt": now or datetime.utcnow()}}, OTP_SIGNUP_FIELDS)
+
+
+# Only if the code checked is still the current one (not reissued meanwhile)
+def mark_otp_verified(email, otp_digest, verified_until):
+    otps.update_one({"email": email, "otp": otp_digest}, otp_verified_update(verified_until))
+
+
+# Predictions, returns False when no user matched the id
+def add_prediction(prediction_doc):
+    predictions.insert_one(prediction_doc)
+    result = users.update_one(
+        {"user_id": prediction_doc["user_id"]},
+        {
+            "$inc": {"prediction_count": 1},
+            "$max": {"last_prediction_at": prediction_doc["created_at"]}
+        }
+    )
+    return result.matched_count > 0
+
+
+# Several predictions of one user in a single insert, and one counter update
+def add_predictions(user_id, prediction_docs):
+    predictions.insert_many(prediction_docs, ordered=False)
+    result = users.update_one(
+        {"user_id": user_id},
+        {
+            "$inc": {"prediction_count": len(prediction_docs)},
+            "$max": {"last_prediction_at": max(doc["created_at"] for doc in prediction_docs)}
+        }
+    )
+    return result.matched_count > 0
+
+
+# Newest first, strictly older than the (created_at, _id) position when given.
+# Returns the cursor itself so callers can stream it a Mongo batch at a time.
+def iter_predictions(user_id, limit, before=None, fields=PREDICTION_LIST_FIELDS):
+    query = {"user_id": user_id}
+    if before:
+        created_at, object_id = before
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": object_id}}
+        ]
+    return (
+        predictions.find(query, fields)
+        .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit)
+        .batch_size(min(limit, 200))
+    )
+
+
+# The stored image of one prediction, only if it belongs to the user
+def find_prediction_image(user_id, prediction_id):
+    return predictions.find_one({"_id": prediction_id, "user_id": user_id}, PREDICTION_IMAGE_FIELDS)
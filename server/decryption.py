@@ -1,6 +1,38 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
+import io
 import os
-import tensorflow as tf
+import struct
+
+ENCRYPTED_MODEL_PATH = "models/encrypted_model.h5"
+
+# Chunked format: MAGIC, then per chunk a 4-byte length and a Fernet token.
+# Each token holds an 8-byte chunk index and a last-chunk flag in front of the
+# plaintext so chunks can't be reordered or the file truncated unnoticed.
+CHUNKED_MAGIC = b"FERNET-CHUNKED-1\n"
+CHUNK_SIZE = 4 * 1024 * 1024
+_CHUNK_HEADER = struct.Struct(">QB")
+_LENGTH = struct.Struct(">I")
+
+# TF thread pools per process, 0 leaves TF's default (all cores). With several
+# processes on one machine each should get its share so they don't oversubscribe.
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", 0))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", 0))
+
+# Has to run before TF creates its thread pools, i.e. before the first op.
+# TF and h5py are imported in the functions that need them, so importing this
+# module (and the app) doesn't pull them in.
+def configure_tf_threads(intra=None, inter=None):
+    import tensorflow as tf
+
+    intra = TF_INTRA_OP_THREADS if intra is None else intra
+    inter = TF_INTER_OP_THREADS if inter is None else inter
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        print(f"TF thread counts not applied, runtime already started: {e}")
 
 # Load the secret key from the key file
 def load_encryption_key():
@@ -8,31 +40,84 @@ def load_encryption_key():
         key = key_file.read()
     return key
 
-# Decrypt the model file
-def decrypt_model():
-    key = load_encryption_key()
+# Encrypt a model file chunk by chunk (used by encryptModel.py)
+def encrypt_model_file(src_path, dst_path, key, chunk_size=CHUNK_SIZE):
+    with open(src_path, "rb") as src:
+        encrypt_model_stream(src, dst_path, key, chunk_size)
+
+# Same, from any readable file object (convert_model.py passes an in-memory buffer)
+def encrypt_model_stream(src, dst_path, key, chunk_size=CHUNK_SIZE):
     cipher = Fernet(key)
+    with open(dst_path, "wb") as dst:
+        dst.write(CHUNKED_MAGIC)
+        index = 0
+        chunk = src.read(chunk_size)
+        while True:
+            next_chunk = src.read(chunk_size)
+            last = not next_chunk
+            token = cipher.encrypt(_CHUNK_HEADER.pack(index, last) + chunk)
+            dst.write(_LENGTH.pack(len(token)))
+            dst.write(token)
+            if last:
+                break
+            chunk = next_chunk
+            index += 1
 
-    # Read the encrypted model file
-    with open("models/encrypted_model.h5", "rb") as encrypted_file:
-        encrypted_data = encrypted_file.read()
+# Decrypt one chunk at a time into an in-memory buffer, so only a single
+# ciphertext chunk is held next to the plaintext
+def _decrypt_chunked(encrypted_file, cipher, out):
+    index = 0
+    while True:
+        length_bytes = encrypted_file.read(_LENGTH.size)
+        if len(length_bytes) < _LENGTH.size:
+            raise InvalidToken("Encrypted model is truncated")
+        (length,) = _LENGTH.unpack(length_bytes)
+        plain = cipher.decrypt(encrypted_file.read(length))
+        chunk_index, last = _CHUNK_HEADER.unpack_from(plain)
+        if chunk_index != index:
+            raise InvalidToken("Encrypted model chunks are out of order")
+        out.write(memoryview(plain)[_CHUNK_HEADER.size:])
+        if last:
+            return
+        index += 1
 
-    # Decrypt the model data
-    decrypted_data = cipher.decrypt(encrypted_data)
+# Decrypt the model file into memory, the plaintext never touches the disk
+def decrypt_model(encrypted_path=ENCRYPTED_MODEL_PATH):
+    key = load_encryption_key()
+    cipher = Fernet(key)
+    decrypted = io.BytesIO()
 
-    # Save the decrypted model temporarily
-    temp_model_path = "models/temp_model.h5"
-    with open(temp_model_path, "wb") as temp_file:
-        temp_file.write(decrypted_data)
+    with open(encrypted_path, "rb") as encrypted_file:
+        if encrypted_file.read(len(CHUNKED_MAGIC)) == CHUNKED_MAGIC:
+            _decrypt_chunked(encrypted_file, cipher, decrypted)
+        else:
+            # Older single-token files written before the chunked format
+            encrypted_file.seek(0)
+            decrypted.write(cipher.decrypt(encrypted_file.read()))
 
-    return temp_model_path
+    decrypted.seek(0)
+    return decrypted
+
+# Build a Keras model straight from an open HDF5 file
+def _load_keras_h5(h5_file):
+    try:
+        # Keras 3 only accepts paths in load_model, use its HDF5 loader directly
+        from keras.src.legacy.saving import legacy_h5_format
+    except ImportError:
+        import tensorflow as tf
+        return tf.keras.models.load_model(h5_file)
+    return legacy_h5_format.load_model_from_hdf5(h5_file)
 
 # Load the decrypted model
-def load_model():
-    decrypted_model_path = decrypt_model()
-    model = tf.keras.models.load_model(decrypted_model_path)
+def load_model(encrypted_path=ENCRYPTED_MODEL_PATH):
+    import h5py
+
+    configure_tf_threads()
+    decrypted = decrypt_model(encrypted_path)
+    with h5py.File(decrypted, "r") as h5_file:
+        model = _load_keras_h5(h5_file)
 
-    # Optional: Delete the temporary model file after loading
-    os.remove(decrypted_model_path)
+    # Drop the plaintext buffer as soon as the model is built
+    decrypted.close()
 
     return model
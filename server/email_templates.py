@@ -0,0 +1,149 @@
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+SUBJECT = 'Your One-Time Password (OTP) for Secure Access'
+
+# Per-message fields are left as markers in the template
+TO = "@@TO@@"
+OTP = "@@OTP@@"
+
+# HTML email body with professional design
+HTML = """\
+<html>
+<head>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            color: #333;
+            background-color: #f4f4f4;
+            padding: 20px;
+        }
+        .email-container {
+            background-color: #ffffff;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
+        }
+        .otp-header {
+            font-size: 20px;
+            font-weight: bold;
+            color: #4CAF50;
+        }
+        .otp {
+            font-size: 32px;
+            font-weight: bold;
+            color: #FF5722;
+            margin: 20px 0;
+        }
+        .footer {
+            font-size: 12px;
+            color: #888888;
+            text-align: center;
+            margin-top: 20px;
+        }
+    </style>
+</head>
+<body>
+    <div class="email-container">
+        <p>Dear User,</p>
+        <p class="otp-header">Your One-Time Password (OTP)</p>
+        <p class="otp">@@OTP@@</p>
+        <p>This OTP will expire in <strong>@@EXPIRY@@ minutes</strong>. Please use it immediately.</p>
+        <p>If you did not request this OTP, please ignore this message.</p>
+        <p class="footer">
+            For security reasons, we recommend not sharing your OTP with anyone.<br>
+            <strong>Do not share this OTP with anyone.</strong><br>
+            If you have any concerns, please contact our support team.
+        </p>
+    </div>
+</body>
+</html>
+"""
+
+TEXT = """\
+Dear User,
+
+Your One-Time Password (OTP) is: @@OTP@@
+
+This OTP will expire in @@EXPIRY@@ minutes. Please use it immediately.
+If you did not request this OTP, please ignore this message.
+
+For security reasons, do not share this OTP with anyone.
+If you have any concerns, please contact our support team.
+"""
+
+
+# Builds the OTP email (plain-text and HTML alternatives) once and keeps it as
+# a list of literal chunks with the recipient and OTP slots in between, so each
+# message is a single join instead of a new f-string and MIME tree.
+class OtpEmailTemplate:
+    subject = SUBJECT
+    text = TEXT
+    html = HTML
+
+    def __init__(self, sender, expiry_minutes=1):
+        self.sender = sender
+        self.expiry_minutes = expiry_minutes
+
+        msg = MIMEMultipart('alternative', boundary="==============otp-email-template==")
+        if sender:
+            msg['From'] = sender
+        msg['To'] = TO
+        msg['Subject'] = self.subject
+        msg.attach(MIMEText(self.text.replace("@@EXPIRY@@", str(expiry_minutes)), 'plain', 'us-ascii'))
+        msg.attach(MIMEText(self.html.replace("@@EXPIRY@@", str(expiry_minutes)), 'html', 'us-ascii'))
+        self._chunks = self._split(msg.as_string())
+
+    @staticmethod
+    def _split(raw):
+        # ["literal", TO, "literal", OTP, ...] in the order the markers appear
+        chunks = []
+        while True:
+            positions = [(raw.find(marker), marker) for marker in (TO, OTP) if marker in raw]
+            if not positions:
+                chunks.append(raw)
+                return chunks
+            index, marker = min(positions)
+            chunks.append(raw[:index])
+            chunks.append(marker)
+            raw = raw[index + len(marker):]
+
+    def render(self, recipient, otp):
+        # The raw message is assembled by hand, so keep header injection and
+        # anything that doesn't fit a 7-bit message out
+        if "\r" in recipient or "\n" in recipient or not recipient.isascii():
+            raise ValueError("Invalid recipient address")
+        values = {TO: recipient, OTP: otp}
+        return "".join(values.get(chunk, chunk) for chunk in self._chunks)
+
+
+MAGIC_LINK_SUBJECT = 'Your login link'
+
+MAGIC_LINK_HTML = """\
+<html>
+<body style="font-family: Arial, sans-serif; color: #333; background-color: #f4f4f4; padding: 20px;">
+    <div style="background-color: #ffffff; padding: 20px; border-radius: 8px;">
+        <p>Dear User,</p>
+        <p><a class="magic-link" href="@@OTP@@">Click here to log in</a></p>
+        <p>This link can be used once and will expire in <strong>@@EXPIRY@@ minutes</strong>.</p>
+        <p>If you did not request this link, please ignore this message.</p>
+    </div>
+</body>
+</html>
+"""
+
+MAGIC_LINK_TEXT = """\
+Dear User,
+
+Log in with this link: @@OTP@@
+
+The link can be used once and will expire in @@EXPIRY@@ minutes.
+If you did not request this link, please ignore this message.
+"""
+
+
+# Same prebuilt message, with the login link in the OTP slot
+class MagicLinkEmailTemplate(OtpEmailTemplate):
+    subject = MAGIC_LINK_SUBJECT
+    text = MAGIC_LINK_TEXT
+    html = MAGIC_LINK_HTML
@@ -1,5 +1,5 @@
 from cryptography.fernet import Fernet
-import os
+from decryption import ENCRYPTED_MODEL_PATH, encrypt_model_file
 
 # Step 1: Generate and save a secure key (only once)
 key = Fernet.generate_key()
@@ -7,16 +7,7 @@ with open("model_secret.key", "wb") as key_file:
     key_file.write(key)
 print("🔐 Key generated and saved to model_secret.key")
 
-# Step 2: Load model file
-with open("models/resnet50_sports_ball_model.h5", "rb") as f:
-    model_data = f.read()
-
-# Step 3: Encrypt the model
-cipher = Fernet(key)
-encrypted_data = cipher.encrypt(model_data)
-
-# Step 4: Save encrypted model
-with open("models/encrypted_model.h5", "wb") as f:
-    f.write(encrypted_data)
+# Step 2 + 3: Encrypt the model in chunks so it can be decrypted as a stream
+encrypt_model_file("models/resnet50_sports_ball_model.h5", ENCRYPTED_MODEL_PATH, key)
 
 print("✅ Model encrypted and saved as encrypted_model.h5")
@@ -0,0 +1,51 @@
+# Multi-worker deployment, run from server/:
+#
+#   gunicorn app:app
+#
+# INFERENCE_MODE=local (default): every worker decrypts and loads its own model.
+# Each worker's TF gets an equal share of the cores unless TF_INTRA_OP_THREADS
+# is set, so the workers don't oversubscribe the machine between them.
+# The same goes for the bcrypt pool every worker runs, in both modes
+# (BCRYPT_WORKERS processes per worker, a share of the cores by default).
+#
+# INFERENCE_MODE=shared: the master starts one inference process before it forks
+# the workers. Only that process loads the model; workers hand it preprocessed
+# tensors through shared memory (see inference_server.py). The master also
+# hands a dead worker's inference slots back and restarts the inference
+# process if it exits.
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+
+
+def on_starting(server):
+    cores = multiprocessing.cpu_count()
+    # The worker count -w or the default settled on, read by token_store.py
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+    # Read by hashing.py in each worker
+    os.environ.setdefault("BCRYPT_WORKERS", str(max(1, cores // server.cfg.workers)))
+
+    if os.getenv("INFERENCE_MODE", "local") == "shared":
+        import inference_server
+        inference_server.start()
+    else:
+        # Read by decryption.configure_tf_threads in each worker
+        os.environ.setdefault("TF_INTRA_OP_THREADS", str(max(1, cores // server.cfg.workers)))
+        os.environ.setdefault("TF_INTER_OP_THREADS", "1")
+
+
+def child_exit(server, worker):
+    if os.getenv("INFERENCE_MODE", "local") == "shared":
+        import inference_server
+        inference_server.reclaim_worker(worker.pid)
+
+
+def on_exit(server):
+    if os.getenv("INFERENCE_MODE", "local") == "shared":
+        import inference_server
+        inference_server.stop()
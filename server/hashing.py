@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from metrics import span
+
+# bcrypt cost factor for new hashes, existing hashes keep the cost they were made with
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+# These run in the worker processes and report when they actually started,
+# so the caller can tell queue wait apart from hashing time
+def _hash(secret, rounds):
+    started = time.monotonic()
+    hashed = bcrypt.hashpw(secret, bcrypt.gensalt(rounds))
+    return hashed, started, time.monotonic()
+
+
+def _check(secret, hashed):
+    started = time.monotonic()
+    ok = bcrypt.checkpw(secret, hashed)
+    return ok, started, time.monotonic()
+
+
+def _noop():
+    return None
+
+
+# One pool per server process, so by default each gets an equal share of the
+# cores: WEB_CONCURRENCY is the worker count both gunicorn.conf.py and uvicorn
+# read (gunicorn.conf.py also sets BCRYPT_WORKERS when -w is given instead).
+def default_workers():
+    return max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", 1))))
+
+
+# Runs bcrypt in a process pool sized to the cores so it never holds up the
+# Flask request threads. At most max_pending jobs may be queued or running;
+# beyond that callers wait up to queue_timeout seconds and then get
+# HashingOverloaded, which the app turns into a 503.
+class BcryptService:
+    def __init__(self, workers=None, max_pending=None, queue_timeout=0.5, rounds=BCRYPT_ROUNDS, stats_window=500):
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or self.workers * 4
+        self.queue_timeout = queue_timeout
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._recent = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._rejected = 0
+
+    def _pool(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # fork where the platform has it (no re-import in the workers),
+                    # the default start method elsewhere (Windows)
+                    fork = "fork" in multiprocessing.get_all_start_methods()
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("fork") if fork else None
+                    )
+        return self._executor
+
+    # Fork the workers up front, before the model and batcher threads exist
+    def start(self):
+        self._pool().submit(_noop).result()
+
+    def _submit(self, blocking, fn, *args):
+        acquired = self._slots.acquire(timeout=self.queue_timeout) if blocking else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._stats_lock:
+                self._rejected += 1
+            raise HashingOverloaded("Too many password hashing requests in flight")
+
+        submitted = time.monotonic()
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future, submitted
+
+    def _finish(self, outcome, submitted):
+        result, started, finished = outcome
+        with self._stats_lock:
+            self._recent.append((started - submitted, finished - started))
+        return result
+
+    def _run(self, fn, *args):
+        future, submitted = self._submit(True, fn, *args)
+        return self._finish(future.result(), submitted)
+
+    # Event loop callers never wait for a slot, a full pool is a 503 straight away
+    async def _run_async(self, fn, *args):
+        future, submitted = self._submit(False, fn, *args)
+        return self._finish(await asyncio.wrap_future(future), submitted)
+
+    # Spans include the wait for a pool slot, stats() splits wait from hashing
+    def hash(self, secret):
+        with span("bcrypt_hash"):
+            return self._run(_hash, secret.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def check(self, secret, hashed):
+        with span("bcrypt_check"):
+            return self._run(_check, secret.encode('utf-8'), hashed.encode('utf-8'))
+
+    async def hash_async(self, secret):
+        with span("bcrypt_hash"):
+            return (await self._run_async(_hash, secret.encode('utf-8'), self.rounds)).decode('utf-8')
+
+    async def check_async(self, secret, hashed):
+        with span("bcrypt_check"):
+            return await self._run_async(_check, secret.encode('utf-8'), hashed.encode('utf-8'))
+
+    def stats(self):
+        with self._stats_lock:
+            recent = list(self._recent)
+            rejected = self._rejected
+
+        stats = {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "rounds": self.rounds,
+            "rejected": rejected,
+        }
+        if recent:
+            waits = sorted(wait * 1000 for wait, _ in recent)
+            hashes = sorted(hashed * 1000 for _, hashed in recent)
+            stats["recent"] = {
+                "jobs": len(recent),
+                "avg_queue_wait_ms": sum(waits) / len(waits),
+                "p95_queue_wait_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                "avg_hash_ms": sum(hashes) / len(hashes),
+                "p95_hash_ms": hashes[min(len(hashes) - 1, int(len(hashes) * 0.95))],
+            }
+        return stats
+
+
+bcrypt_service = BcryptService(
+    workers=int(os.getenv("BCRYPT_WORKERS", 0)) or None,
+    max_pending=int(os.getenv("BCRYPT_MAX_PENDING", 0)) or None,
+    queue_timeout=float(os.getenv("BCRYPT_QUEUE_TIMEOUT_MS", 500)) / 1000,
+)
@@ -0,0 +1,451 @@
+import multiprocessing
+import os
+import signal
+import struct
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batcher import BatcherFull, MicroBatcher
+from preprocessing import IMAGE_SIZE
+
+# Status of a slot after the inference process is done with it
+_OK = 0
+_FAILED = 1
+
+# Slot states, only changed under the slot lock
+_FREE = 0
+_TAKEN = 1     # claimed by a worker, the inference process doesn't owe it anything
+_QUEUED = 2    # sent, the inference process owes it a result
+_ORPHANED = 3  # sent, but its worker gave up or died: freed once the inference process is done with it
+
+# (slot, ticket) as written to the request pipe, small enough to be atomic
+_REQUEST = struct.Struct("ii")
+
+
+class InferenceUnavailable(Exception):
+    pass
+
+
+# Builds the predict function inside the inference process, so TF and the model
+# only ever live there. Returns (predict_fn, version_fn).
+def _model_registry_predictor():
+    from model_registry import model_registry
+    model_registry.get()
+    return (lambda batch: model_registry.get().predict(batch, verbose=0)), (lambda: model_registry.version)
+
+
+# One inference process serving every HTTP worker on the machine
+# (INFERENCE_MODE=shared). The gunicorn master creates it before forking the
+# workers, so the decrypted model exists once instead of once per worker.
+#
+# Inputs and outputs live in a block of shared memory split into fixed slots.
+# A worker claims a free slot, copies its preprocessed tensor into it and
+# writes only the slot number to a pipe the inference process reads. That
+# process micro-batches the slots it receives, writes each row of predictions
+# back into its slot and releases the slot's semaphore. No arrays are pickled
+# in either direction, and the request path relies on no helper threads, so a
+# process forked at any point (gunicorn workers) can use it.
+#
+# Every slot records the pid of the worker holding it. When a worker dies the
+# master hands its slots back (reclaim_worker, from gunicorn's child_exit), and
+# a watchdog thread in the master starts a new inference process when the
+# current one exits, failing whatever requests it still owed.
+class SharedInference:
+    def __init__(self, slots=64, input_shape=(IMAGE_SIZE[1], IMAGE_SIZE[0], 3), input_dtype=np.uint8,
+                 max_outputs=1024, max_batch_size=16, max_wait_ms=10, slot_timeout=5,
+                 predictor=_model_registry_predictor, stats_window=500, watch_interval=1):
+        ctx = multiprocessing.get_context("fork")
+        self.slots = slots
+        self.input_shape = tuple(input_shape)
+        self.input_dtype = np.dtype(input_dtype)
+        self.max_outputs = max_outputs
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.slot_timeout = slot_timeout
+        self.predictor = predictor
+        self.watch_interval = watch_interval
+
+        input_bytes = slots * int(np.prod(self.input_shape)) * self.input_dtype.itemsize
+        input_bytes += -input_bytes % 4
+        output_bytes = slots * max_outputs * 4
+        self._shm = shared_memory.SharedMemory(create=True, size=input_bytes + output_bytes + 10 * slots)
+        self._inputs = np.ndarray((slots,) + self.input_shape, dtype=self.input_dtype, buffer=self._shm.buf)
+        offset = input_bytes
+        self._outputs = np.ndarray((slots, max_outputs), dtype=np.float32, buffer=self._shm.buf, offset=offset)
+        offset += output_bytes
+        self._owner_pid = np.ndarray((slots,), dtype=np.int32, buffer=self._shm.buf, offset=offset)
+        offset += 4 * slots
+        # Bumped on every claim, so a request left in the pipe by a dead
+        # inference process can't be mistaken for the slot's next request
+        self._ticket = np.ndarray((slots,), dtype=np.int32, buffer=self._shm.buf, offset=offset)
+        offset += 4 * slots
+        self._status = np.ndarray((slots,), dtype=np.int8, buffer=self._shm.buf, offset=offset)
+        self._owner = np.ndarray((slots,), dtype=np.int8, buffer=self._shm.buf, offset=offset + slots)
+        self._owner[:] = _FREE
+        self._owner_pid[:] = 0
+        self._ticket[:] = 0
+
+        # Counts free slots, the inference process fills it once it is running
+        self._free = ctx.Semaphore(0)
+        self._owner_lock = ctx.Lock()
+        # A pipe rather than a multiprocessing queue: a reader killed mid-read
+        # leaves no lock behind, so a new inference process can pick it up
+        self._requests_read, self._requests_write = os.pipe()
+        self._done = [ctx.Semaphore(0) for _ in range(slots)]
+        self._output_width = ctx.Value("i", 0, lock=False)
+        self._version = ctx.Array("c", 64, lock=False)
+        self._pid = ctx.Value("i", 0, lock=False)
+        self._starts = ctx.Value("i", 0, lock=False)
+
+        # Master only
+        self._stopping = threading.Event()
+        self._watchdog = None
+
+        # Per worker process, only the request path touches these
+        self._recent = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._totals = {"requests": 0, "rejected": 0, "timed_out": 0, "failed": 0}
+
+    @property
+    def pid(self):
+        return self._pid.value or None
+
+    def start(self):
+        if not self._pid.value:
+            self._spawn()
+            self._watchdog = threading.Thread(target=self._watch, name="inference-watchdog", daemon=True)
+            self._watchdog.start()
+        return self
+
+    # Plain fork rather than multiprocessing.Process: gunicorn forks its workers
+    # from this process too, and a worker must not see the inference process as
+    # its own child (multiprocessing would terminate it when the worker exits)
+    def _spawn(self):
+        self._starts.value += 1
+        pid = os.fork()
+        if pid == 0:
+            # Ctrl-C reaches the whole process group, the master stops us through stop()
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 0
+            try:
+                self._serve()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self._pid.value = pid
+        print(f"Inference process started (pid {pid}, {self.slots} slots)")
+
+    # Runs in the master next to gunicorn's own loop. gunicorn reaps every
+    # child of the master, so a ChildProcessError means it already reaped ours.
+    def _watch(self):
+        while not self._stopping.wait(self.watch_interval):
+            try:
+                exited = os.waitpid(self._pid.value, os.WNOHANG)[0] != 0
+            except ChildProcessError:
+                exited = True
+            if exited and not self._stopping.is_set():
+                print(f"Inference process {self._pid.value} exited, restarting it")
+                self._restart()
+
+    # Requests the dead process still owed fail now instead of timing out,
+    # the ones nobody waits for any more are freed
+    def _restart(self):
+        with self._owner_locked():
+            for slot in range(self.slots):
+                if self._owner[slot] == _QUEUED:
+                    self._status[slot] = _FAILED
+                    self._owner[slot] = _TAKEN
+                    self._done[slot].release()
+                elif self._owner[slot] == _ORPHANED:
+                    self._free_slot(slot)
+        self._spawn()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+        pid = self._pid.value
+        if pid:
+            os.write(self._requests_write, _REQUEST.pack(-1, 0))
+            deadline = time.monotonic() + timeout
+            try:
+                while os.waitpid(pid, os.WNOHANG)[0] == 0:
+                    if time.monotonic() > deadline:
+                        os.kill(pid, signal.SIGTERM)
+                        os.waitpid(pid, 0)
+                        break
+                    time.sleep(0.05)
+            except ChildProcessError:
+                pass  # already reaped (gunicorn reaps every child of the master)
+            self._pid.value = 0
+        os.close(self._requests_read)
+        os.close(self._requests_write)
+        self._shm.close()
+        self._shm.unlink()
+
+    # Inference process main loop
+    def _serve(self):
+        # Slots only become available once the first inference process is
+        # running, requests sent while the model loads wait in the pipe
+        if self._starts.value == 1:
+            for _ in range(self.slots):
+                self._free.release()
+
+        predict_fn, version_fn = self.predictor()
+        self._publish_version(version_fn)
+        batcher = MicroBatcher(predict_fn, max_batch_size=self.max_batch_size,
+                               max_wait_ms=self.max_wait_ms, max_queue=self.slots)
+
+        while True:
+            slot, ticket = self._next_request()
+            if slot < 0:
+                return
+            with self._owner_lock:
+                if self._ticket[slot] != ticket:
+                    continue  # left over from a previous inference process
+                if self._owner[slot] == _ORPHANED:
+                    self._free_slot(slot)
+                if self._owner[slot] != _QUEUED:
+                    continue
+            try:
+                future = batcher.submit(self._inputs[slot])
+            except BatcherFull:
+                self._finish(slot, ticket, None, version_fn)
+                continue
+            future.add_done_callback(lambda f, slot=slot, ticket=ticket: self._finish(slot, ticket, f, version_fn))
+
+    def _next_request(self):
+        data = b""
+        while len(data) < _REQUEST.size:
+            chunk = os.read(self._requests_read, _REQUEST.size - len(data))
+            if not chunk:
+                return -1, 0
+            data += chunk
+        return _REQUEST.unpack(data)
+
+    def _finish(self, slot, ticket, future, version_fn):
+        if future is None or future.exception() is not None:
+            if future is not None:
+                print(f"Inference failed: {future.exception()}")
+            status = _FAILED
+        else:
+            preds = np.ravel(future.result())
+            self._outputs[slot, :len(preds)] = preds
+            self._output_width.value = len(preds)
+            self._publish_version(version_fn)
+            status = _OK
+
+        with self._owner_lock:
+            if self._ticket[slot] != ticket:
+                return
+            if self._owner[slot] == _ORPHANED:
+                self._free_slot(slot)
+            elif self._owner[slot] == _QUEUED:
+                self._status[slot] = status
+                self._owner[slot] = _TAKEN
+                self._done[slot].release()
+
+    # A hot reload in the inference process changes the version the workers see
+    def _publish_version(self, version_fn):
+        version = (version_fn() or "").encode()[:64]
+        if version != self._version.value:
+            self._version.value = version
+
+    # Called from the HTTP workers, same contract as MicroBatcher.predict
+    def predict(self, img_array, timeout=None):
+        return self._receive(*self._send(img_array), timeout)
+
+    # Several images at once (/predict/batch), they reach the inference process
+    # back to back and normally share one forward pass. Sent in waves: wait for
+    # one free slot, take whatever other slots are free right now, collect those
+    # results (freeing the slots) and go on. A call never waits for a slot while
+    # it holds others, so concurrent batches can't starve each other, and a
+    # batch bigger than the slot count still goes through.
+    def predict_many(self, batch, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        preds = []
+        while len(preds) < len(batch):
+            sent = [self._send(batch[len(preds)])]
+            while len(preds) + len(sent) < len(batch):
+                request = self._send(batch[len(preds) + len(sent)], block=False)
+                if request is None:
+                    break
+                sent.append(request)
+
+            for i, request in enumerate(sent):
+                try:
+                    preds.append(self._receive(*request, None if deadline is None else max(0, deadline - time.monotonic())))
+                except InferenceUnavailable:
+                    with self._owner_lock:
+                        for slot, _, _ in sent[i + 1:]:
+                            self._abandon(slot)
+                    raise
+        return np.stack(preds)
+
+    # None when block=False and no slot is free
+    def _send(self, img_array, block=True):
+        started = time.monotonic()
+        slot = self._claim(block)
+        if slot is None:
+            return None
+        acquired = time.monotonic()
+
+        np.copyto(self._inputs[slot], np.reshape(img_array, self.input_shape))
+        with self._owner_lock:
+            self._owner[slot] = _QUEUED
+            ticket = int(self._ticket[slot])
+        os.write(self._requests_write, _REQUEST.pack(slot, ticket))
+        return slot, started, acquired
+
+    def _receive(self, slot, started, acquired, timeout):
+        if not self._done[slot].acquire(timeout=timeout):
+            # The inference process frees the slot once it is done with it
+            with self._owner_lock:
+                self._abandon(slot)
+            self._count("timed_out")
+            raise InferenceUnavailable("Inference did not answer in time")
+
+        try:
+            if self._status[slot] != _OK:
+                self._count("failed")
+                raise InferenceUnavailable("Inference failed")
+            preds = self._outputs[slot, :self._output_width.value].copy()
+        finally:
+            with self._owner_lock:
+                self._free_slot(slot)
+
+        finished = time.monotonic()
+        with self._stats_lock:
+            self._totals["requests"] += 1
+            self._recent.append((acquired - started, finished - acquired))
+        return preds
+
+    def _claim(self, block=True):
+        if not block:
+            if not self._free.acquire(block=False):
+                return None
+        elif not self._free.acquire(timeout=self.slot_timeout):
+            self._count("rejected")
+            raise BatcherFull("No free inference slot")
+        with self._owner_lock:
+            slot = int(np.argmax(self._owner == _FREE))
+            self._owner[slot] = _TAKEN
+            self._owner_pid[slot] = os.getpid()
+            self._ticket[slot] += 1
+        return slot
+
+    # The helpers below expect the slot lock to be held
+    def _free_slot(self, slot):
+        self._owner[slot] = _FREE
+        self._owner_pid[slot] = 0
+        self._free.release()
+
+    # Nobody will read this slot's result: a slot the inference process still
+    # owes is left for it to free, any other is free right away (dropping a
+    # result that may have come in since)
+    def _abandon(self, slot):
+        if self._owner[slot] == _QUEUED:
+            self._owner[slot] = _ORPHANED
+        elif self._owner[slot] == _TAKEN:
+            while self._done[slot].acquire(block=False):
+                pass
+            self._free_slot(slot)
+
+    # A worker killed while holding the slot lock would hold it forever, the
+    # master waits a moment and then takes it over
+    @contextmanager
+    def _owner_locked(self, timeout=2):
+        if not self._owner_lock.acquire(timeout=timeout):
+            print("Inference slot lock held by a dead process, taking it over")
+        try:
+            yield
+        finally:
+            self._owner_lock.release()
+
+    # Called in the master when a worker exits, the slots it held go back
+    def reclaim_worker(self, pid):
+        with self._owner_locked():
+            slots = np.flatnonzero((self._owner_pid == pid) & (self._owner != _FREE))
+            for slot in slots:
+                self._abandon(int(slot))
+        if len(slots):
+            print(f"Reclaimed {len(slots)} inference slots from worker {pid}")
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._totals[key] += 1
+
+    # Version of the model in the inference process. While it is still loading,
+    # the version of the file it is loading, like ModelRegistry.current_version
+    def model_version(self):
+        version = self._version.value.decode()
+        if version:
+            return version
+        from model_registry import model_registry
+        return model_registry.current_version()
+
+    # Counters of this worker process, for /predict/stats
+    def stats(self):
+        with self._stats_lock:
+            recent = list(self._recent)
+            totals = dict(self._totals)
+
+        stats = {"mode": "shared", "slots": self.slots, "free_slots": self._free.get_value(),
+                 "inference_restarts": max(0, self._starts.value - 1), **totals}
+        if recent:
+            waits = np.array([wait for wait, _ in recent]) * 1000
+            round_trips = np.array([trip for _, trip in recent]) * 1000
+            stats["recent"] = {
+                "requests": len(recent),
+                "avg_slot_wait_ms": float(waits.mean()),
+                "avg_round_trip_ms": float(round_trips.mean()),
+                "p95_round_trip_ms": float(np.percentile(round_trips, 95)),
+            }
+        return stats
+
+
+shared_inference = None
+
+
+# Started by the gunicorn master (see gunicorn.conf.py) before the workers fork
+def start(**kwargs):
+    global shared_inference
+    if shared_inference is None:
+        shared_inference = SharedInference(
+            slots=int(os.getenv("INFERENCE_SLOTS", 64)),
+            max_batch_size=int(os.getenv("PREDICT_MAX_BATCH_SIZE", 16)),
+            max_wait_ms=float(os.getenv("PREDICT_MAX_WAIT_MS", 10)),
+            **kwargs
+        ).start()
+    return shared_inference
+
+
+# gunicorn's child_exit hook in the master
+def reclaim_worker(pid):
+    if shared_inference is not None:
+        shared_inference.reclaim_worker(pid)
+
+
+def stop():
+    global shared_inference
+    if shared_inference is not None:
+        shared_inference.stop()
+        shared_inference = None
+
+
+# The inference process this worker inherited from the master. Without one
+# (e.g. `python app.py` with INFERENCE_MODE=shared) it is started here.
+def connect():
+    if shared_inference is None:
+        print("No shared inference process inherited, starting one for this process")
+        return start()
+    return shared_inference
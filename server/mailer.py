@@ -0,0 +1,206 @@
+import os
+import smtplib
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import PyMongoError
+
+from encryption import EnvelopeError
+from metrics import span
+
+
+
+# Authenticated with the sealed message, so it only opens for the same recipient
+def _message_context(recipient):
+    return b"mail:" + recipient.encode("utf-8")
+
+
+# Keeps one authenticated SMTP connection open and reuses it for every
+# message, reconnecting once when the server has dropped it. Anything with
+# the same send(sender, recipients, message) method can stand in for it.
+class SMTPTransport:
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self._conn = None
+
+    def _connect(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._conn = None
+
+    def send(self, sender, recipients, message):
+        if self._conn is None:
+            self._connect()
+        try:
+            self._conn.sendmail(sender, recipients, message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Idle connections get closed by the server, retry once on a fresh one
+            self.close()
+            self._connect()
+            self._conn.sendmail(sender, recipients, message)
+
+
+def transport_from_env():
+    return SMTPTransport(
+        host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+        port=int(os.getenv("SMTP_PORT", 465)),
+        username=os.getenv("SMTP_EMAIL"),
+        password=os.getenv("SMTP_PASSWORD"),
+        use_ssl=os.getenv("SMTP_SSL", "1") == "1",
+        starttls=os.getenv("SMTP_STARTTLS", "0") == "1",
+    )
+
+
+# Outbound mail queue stored in Mongo. enqueue() returns as soon as the
+# message is saved; a background thread in each worker claims messages
+# atomically and sends them, retrying with backoff. Messages that are still
+# unsent at expire_at are dropped by a TTL index (an expired OTP is useless).
+# With a sealer the message (which holds the OTP or login link) is stored
+# encrypted and bound to its recipient, and only opened right before sending.
+class MailQueue:
+    def __init__(self, collection, transport, sealer=None, max_attempts=5, retry_delay=5, poll_interval=5,
+                 claim_timeout=60):
+        self.collection = collection
+        self.transport = transport
+        self.sealer = sealer
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._counters = {"sent": 0, "retried": 0, "failed": 0}
+
+    def build_job(self, sender, recipient, message, expire_at):
+        now = datetime.utcnow()
+        if self.sealer is not None:
+            message = self.sealer.seal(message.encode("utf-8"), _message_context(recipient))
+        return {
+            "sender": sender,
+            "recipient": recipient,
+            "message": message,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            "expire_at": expire_at
+        }
+
+    def enqueue(self, sender, recipient, message, expire_at):
+        self.collection.insert_one(self.build_job(sender, recipient, message, expire_at))
+        self.notify()
+
+    # Wake the sender after a job was inserted some other way (e.g. the async client)
+    def notify(self):
+        self._wake.set()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mail-sender", daemon=True)
+                self._thread.start()
+
+    # Pending messages that are due, or messages a crashed sender claimed and never finished
+    def _claim(self):
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "expire_at": {"$gt": now},
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "sending", "claimed_until": {"$lte": now}}
+                ]
+            },
+            {"$set": {"status": "sending", "claimed_until": now + timedelta(seconds=self.claim_timeout)}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self):
+        while True:
+            try:
+                job = self._claim()
+            except PyMongoError as e:
+                print(f"Mail queue unavailable: {e}")
+                job = None
+
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            try:
+                self._deliver(job)
+            except PyMongoError as e:
+                # The claim runs out and another pass picks the message up again
+                print(f"Mail queue unavailable: {e}")
+
+    def _open(self, job):
+        message = job["message"]
+        if isinstance(message, str):
+            # Queued before messages were sealed
+            return message
+        return self.sealer.open(message, _message_context(job["recipient"])).decode("utf-8")
+
+    def _deliver(self, job):
+        try:
+            message = self._open(job)
+        except (EnvelopeError, AttributeError) as e:
+            print(f"Dropping email to {job['recipient']}, message can't be decrypted: {e}")
+            self.collection.delete_one({"_id": job["_id"]})
+            self._counters["failed"] += 1
+            return
+
+        try:
+            with span("smtp_send"):
+                self.transport.send(job["sender"], [job["recipient"]], message)
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            if attempts >= self.max_attempts:
+                print(f"Giving up on email to {job['recipient']} after {attempts} attempts: {e}")
+                self.collection.delete_one({"_id": job["_id"]})
+                self._counters["failed"] += 1
+                return
+
+            print(f"Error sending email to {job['recipient']} (attempt {attempts}): {e}")
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            self.collection.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "status": "pending",
+                    "attempts": attempts,
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)
+                }}
+            )
+            self._counters["retried"] += 1
+            return
+
+        self.collection.delete_one({"_id": job["_id"]})
+        self._counters["sent"] += 1
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["queued"] = self.collection.count_documents({})
+        return stats
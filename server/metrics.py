@@ -0,0 +1,156 @@
+import bisect
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, from sub-millisecond Mongo calls up to a model load
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Cumulative histogram per label set, rendered in the Prometheus text format.
+# Observing is a bisect and three additions under a lock, cheap enough to
+# leave on for every request.
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket = _labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {values[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {values[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# One registry per process. Under gunicorn every worker keeps its own, so a
+# scrape sees the worker that answered it (label the target by instance/pod).
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time spent in a request handler.", ("route", "method", "status"))
+STAGE_SECONDS = registry.histogram(
+    "app_stage_duration_seconds", "Time spent in one stage of a request or background job.", ("route", "stage"))
+MONGO_SECONDS = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trips as reported by the driver.", ("route", "command"))
+
+# Route (Flask endpoint) the current thread is serving, so spans deep inside
+# helpers are attributed to it. Background threads report "none".
+_route = contextvars.ContextVar("metrics_route", default="none")
+
+
+def set_route(route):
+    _route.set(route or "none")
+
+
+def span(stage):
+    return STAGE_SECONDS.time(route=_route.get(), stage=stage)
+
+
+# Registered on the MongoClient (database.create_client); the driver calls it on
+# the thread that ran the command. mongomock doesn't publish these events.
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, route=_route.get(), command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, route=_route.get(), command=event.command_name)
+
+
+# Profiles the request thread. pyinstrument (optional) samples the stack every
+# interval seconds; without it the stdlib's cProfile traces every call, which
+# is slower and inflates small functions, but needs nothing extra installed.
+class RequestProfiler:
+    def __init__(self, interval=0.001):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            self._profiler = cProfile.Profile()
+            self.kind = "cprofile"
+        else:
+            self._profiler = Profiler(interval=interval)
+            self.kind = "pyinstrument"
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            return self._profiler.output_text(unicode=False, color=False)
+        self._profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        return out.getvalue()
@@ -0,0 +1,96 @@
+# Moves predictions embedded in User documents into the predictions collection.
+# Safe to re-run: every embedded entry is upserted by (user_id, legacy_index)
+# and the embedded array is only removed once all of its entries are copied.
+#
+#   python migrate_predictions.py [--dry-run] [--batch-size 50]
+import argparse
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from schema import MASTER_KEY, aes_decrypt
+
+ENCRYPTED_FIELDS = ("input_image", "result", "image_url", "predicted_at")
+
+
+def legacy_created_at(entry, user):
+    predicted_at = aes_decrypt(entry.get("predicted_at"), MASTER_KEY) if entry.get("predicted_at") else None
+    if predicted_at:
+        try:
+            return datetime.fromisoformat(predicted_at)
+        except ValueError:
+            pass
+    return user.get("created_at") or datetime.utcnow()
+
+
+def migrate_user(users, predictions, user, dry_run=False):
+    entries = user.get("predictions") or []
+    ops = []
+    last = None
+    for index, entry in enumerate(entries):
+        # user_id and legacy_index come from the filter on insert
+        doc = {field: entry.get(field) for field in ENCRYPTED_FIELDS}
+        doc["created_at"] = legacy_created_at(entry, user)
+        last = max(last, doc["created_at"]) if last else doc["created_at"]
+        ops.append(UpdateOne(
+            {"user_id": user["user_id"], "legacy_index": index},
+            {"$setOnInsert": doc},
+            upsert=True
+        ))
+
+    if dry_run or not ops:
+        return len(ops)
+
+    predictions.bulk_write(ops, ordered=False)
+
+    # Count from the collection so predictions made after the deploy are included
+    users.update_one(
+        {"_id": user["_id"]},
+        {
+            "$unset": {"predictions": ""},
+            "$set": {"prediction_count": predictions.count_documents({"user_id": user["user_id"]})},
+            "$max": {"last_prediction_at": last}
+        }
+    )
+    return len(ops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move embedded predictions into their own collection")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    parser.add_argument("--batch-size", type=int, default=50, help="users fetched per round-trip")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI"))["ImageClassification"]
+    users, predictions = db["User"], db["predictions"]
+
+    predictions.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+    predictions.create_index(
+        [("user_id", 1), ("legacy_index", 1)],
+        unique=True,
+        partialFilterExpression={"legacy_index": {"$exists": True}}
+    )
+
+    migrated_users = migrated_predictions = 0
+    cursor = users.find(
+        {"predictions.0": {"$exists": True}},
+        {"user_id": 1, "created_at": 1, "predictions": 1},
+        batch_size=args.batch_size
+    )
+    for user in cursor:
+        migrated_predictions += migrate_user(users, predictions, user, args.dry_run)
+        migrated_users += 1
+
+    # Users that never predicted only need the empty array dropped
+    if not args.dry_run:
+        users.update_many({"predictions": {"$size": 0}}, {"$unset": {"predictions": ""}})
+
+    action = "Would move" if args.dry_run else "Moved"
+    print(f"{action} {migrated_predictions} predictions from {migrated_users} users")
+
+
+if __name__ == "__main__":
+    main()
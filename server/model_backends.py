@@ -0,0 +1,123 @@
+import os
+import threading
+
+import numpy as np
+
+from decryption import (
+    ENCRYPTED_MODEL_PATH, TF_INTER_OP_THREADS, TF_INTRA_OP_THREADS, decrypt_model,
+    load_model as load_keras_model,
+)
+
+# Output order of every backend, converted models keep the Keras model's order
+CLASS_NAMES = [
+    'american_football', 'baseball', 'basketball', 'billiard_ball',
+    'bowling_ball', 'cricket_ball', 'football', 'golf_ball',
+    'hockey_ball', 'hockey_puck', 'rugby_ball', 'shuttlecock',
+    'table_tennis_ball', 'tennis_ball', 'volleyball'
+]
+
+# Engine used to serve predictions, picked at startup. tflite and onnx need a
+# converted model (see convert_model.py), MODEL_BACKEND_PATH overrides its
+# location. onnx also needs the optional onnxruntime package.
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "keras")
+BACKEND_PATHS = {
+    "keras": ENCRYPTED_MODEL_PATH,
+    "tflite": "models/encrypted_model.tflite",
+    "onnx": "models/encrypted_model.onnx",
+}
+
+
+# All backends take a (N, H, W, 3) batch of unnormalized pixels and return
+# (N, len(CLASS_NAMES)) probabilities. predict() keeps Keras' signature so the
+# batcher doesn't care which engine it is talking to.
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch, verbose=0):
+        # One batch, without the dataset setup model.predict does on every call
+        return np.asarray(self.model.predict_on_batch(np.asarray(batch, dtype=np.float32)))
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, model_content, num_threads=None):
+        self._interpreter = _tflite_interpreter_class()(model_content=model_content, num_threads=num_threads or None)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # An interpreter must not be invoked from two threads at once
+        self._lock = threading.Lock()
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=self._input["dtype"])
+        with self._lock:
+            # The converted graph has a fixed batch size, resize it when the batch changes
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output["index"]).copy()
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_content, intra_threads=None, inter_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("MODEL_BACKEND=onnx needs the onnxruntime package") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_threads:
+            options.intra_op_num_threads = intra_threads
+        if inter_threads:
+            options.inter_op_num_threads = inter_threads
+        self._session = ort.InferenceSession(model_content, options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def predict(self, batch, verbose=0):
+        return self._session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+# The standalone LiteRT runtime when installed, otherwise the interpreter bundled with TF
+def _tflite_interpreter_class():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def _decrypted_bytes(path):
+    decrypted = decrypt_model(path)
+    try:
+        return decrypted.getvalue()
+    finally:
+        decrypted.close()
+
+
+def backend_path(name=MODEL_BACKEND):
+    if name not in BACKEND_PATHS:
+        raise ValueError(f"Unknown MODEL_BACKEND {name!r}, expected one of {', '.join(BACKEND_PATHS)}")
+    return os.getenv("MODEL_BACKEND_PATH") or BACKEND_PATHS[name]
+
+
+# Decrypt and load the model for one backend, the plaintext never touches the disk
+def load_backend(name=MODEL_BACKEND, path=None):
+    path = path or backend_path(name)
+    if name == "keras":
+        return KerasBackend(load_keras_model(path))
+    if name == "tflite":
+        return TFLiteBackend(_decrypted_bytes(path), num_threads=TF_INTRA_OP_THREADS)
+    if name == "onnx":
+        return OnnxBackend(_decrypted_bytes(path), TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS)
+    raise ValueError(f"Unknown MODEL_BACKEND {name!r}, expected one of {', '.join(BACKEND_PATHS)}")
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import time
+from functools import partial
+
+from decryption import ENCRYPTED_MODEL_PATH, load_model
+from metrics import span
+from model_backends import MODEL_BACKEND, backend_path, load_backend
+
+
+# Hash the encrypted model file in chunks so big models don't spike memory
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# The model file can't be read (missing, or being replaced), requests get a 503
+class ModelUnavailable(Exception):
+    pass
+
+
+# Keeps one decrypted model per worker process and hands the same
+# instance to every request instead of decrypting on each call
+class ModelRegistry:
+    def __init__(self, path=ENCRYPTED_MODEL_PATH, loader=load_model, check_interval=0):
+        self.path = path
+        self.loader = loader
+        self.check_interval = check_interval  # seconds between mtime checks, 0 = never
+        self._lock = threading.Lock()
+        self._model = None
+        self._mtime = None
+        self._digest = None
+        self._last_check = 0.0
+        self._reloader = None
+        self._reloader_lock = threading.Lock()
+        # Digest of the file on disk before the model has loaded, reused while its mtime and size stay the same
+        self._file_lock = threading.Lock()
+        self._file_digest = (None, None)
+
+    @property
+    def version(self):
+        # Hash of the encrypted file the current model was built from
+        return self._digest
+
+    # Version of the model that would serve a request right now, without loading
+    # it. Until the model is loaded the file is hashed once, not on every request.
+    def current_version(self):
+        if self._digest is not None:
+            return self._digest
+        with self._file_lock:
+            try:
+                stat = os.stat(self.path)
+                key, digest = self._file_digest
+                if key != (stat.st_mtime, stat.st_size):
+                    key, digest = (stat.st_mtime, stat.st_size), file_digest(self.path)
+                    self._file_digest = (key, digest)
+            except OSError as e:
+                raise ModelUnavailable(f"Cannot read model file {self.path}: {e}") from e
+            return digest
+
+    def is_loaded(self):
+        return self._model is not None
+
+    def get(self):
+        model = self._model
+        if model is not None:
+            if self.check_interval and time.monotonic() - self._last_check >= self.check_interval:
+                self._reload_in_background()
+            return model
+
+        # First use: only one thread decrypts, the rest wait for it
+        with self._lock:
+            if self._model is None:
+                self._load(os.path.getmtime(self.path), file_digest(self.path))
+            return self._model
+
+    # get() is called from the micro-batcher thread, so the check and any reload
+    # run on their own thread; inference carries on with the current model
+    def _reload_in_background(self):
+        with self._reloader_lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                return
+            self._last_check = time.monotonic()
+            self._reloader = threading.Thread(target=self._background_reload, name="model-reload", daemon=True)
+            self._reloader.start()
+
+    def _background_reload(self):
+        try:
+            self.reload_if_changed()
+        except Exception as e:
+            # e.g. the file is being replaced right now, the next check tries again
+            print(f"Model reload failed, still serving sha256 {(self._digest or '')[:12]}: {e}")
+
+    def reload_if_changed(self):
+        # Cheap mtime check first, only hash the file when the mtime moved
+        with self._lock:
+            self._last_check = time.monotonic()
+            mtime = os.path.getmtime(self.path)
+            if self._model is not None and mtime == self._mtime:
+                return False
+
+            digest = file_digest(self.path)
+            if self._model is not None and digest == self._digest:
+                self._mtime = mtime
+                return False
+
+            self._load(mtime, digest)
+            return True
+
+    def reload(self):
+        with self._lock:
+            self._load(os.path.getmtime(self.path), file_digest(self.path))
+
+    def _load(self, mtime, digest):
+        # Requests keep using the old model until the new one is fully built,
+        # then the reference is swapped
+        with span("model_load"):
+            model = self.loader(self.path)
+        self._model = model
+        self._mtime = mtime
+        self._digest = digest
+        self._last_check = time.monotonic()
+        print(f"Model loaded from {self.path} (sha256 {digest[:12]})")
+
+
+# Serves whichever engine MODEL_BACKEND selects, each with its own encrypted file
+model_registry = ModelRegistry(
+    path=backend_path(MODEL_BACKEND),
+    loader=partial(load_backend, MODEL_BACKEND),
+    check_interval=float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", 0))
+)
+
+
+def get_model():
+    return model_registry.get()
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+# Key on the image bytes plus the model version, so a new model never serves old answers
+def cache_key(image_bytes, model_version):
+    digest = hashlib.sha256((model_version or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+# Two-tier cache of predicted class names: a bounded in-process LRU in front of
+# an optional Mongo collection shared by every worker (expired by the TTL index
+# database.ensure_indexes creates on created_at)
+class PredictionCache:
+    def __init__(self, max_entries=1024, collection=None):
+        self.max_entries = max_entries
+        self.collection = collection
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "shared_hits": 0, "misses": 0}
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return result
+
+        if self.collection is not None:
+            doc = self.collection.find_one({"_id": key}, {"result": 1})
+            if doc:
+                self._remember(key, doc["result"])
+                with self._lock:
+                    self._counters["shared_hits"] += 1
+                return doc["result"]
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key, result):
+        self._remember(key, result)
+        if self.collection is not None:
+            self.collection.update_one(
+                {"_id": key},
+                {"$set": {"result": result, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+
+    def _remember(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["memory_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        stats["shared_tier"] = self.collection is not None
+        return stats
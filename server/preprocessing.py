@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = (256, 256)
+
+# JPEG draft decoding can be turned off if a model turns out to be sensitive to it
+USE_JPEG_DRAFT = os.getenv("PREPROCESS_JPEG_DRAFT", "1") == "1"
+
+# Uploads are checked against their header before anything is decoded: only
+# these formats, and no more pixels than this (a small, highly compressible
+# file can claim huge dimensions and expand to gigabytes when decoded).
+ALLOWED_FORMATS = {"JPEG", "PNG"}
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))
+# Pillow's own guard as a backstop (it raises at twice this)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Everything a bad upload can raise while being opened or decoded
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+# Image.open only parses the header, so this runs before any pixel is decoded
+def open_image(source):
+    img = Image.open(source)
+    if img.format not in ALLOWED_FORMATS:
+        raise InvalidImage(f"Unsupported image format {img.format}")
+    if img.width * img.height > MAX_IMAGE_PIXELS:
+        raise InvalidImage(f"Image is too large ({img.width}x{img.height})")
+    return img
+
+
+# Open an image as RGB. For JPEGs, ask the decoder for the smallest DCT scale
+# (1/2, 1/4 or 1/8) that is still at least `size`, so big phone photos don't
+# get fully decoded just to be thrown away by the resize.
+def load_rgb(source, size=IMAGE_SIZE, use_draft=USE_JPEG_DRAFT):
+    img = open_image(source)
+    if use_draft and img.format == "JPEG":
+        img.draft("RGB", size)
+    return img.convert("RGB")
+
+
+# Decode and resize one image (path or file object) into out, a (H, W, 3) uint8 slot
+def preprocess_into(source, out, size=IMAGE_SIZE, use_draft=USE_JPEG_DRAFT):
+    img = load_rgb(source, size, use_draft).resize(size)
+    # Do NOT divide by 255 because model was trained without normalization
+    out[...] = img
+    return out
+
+
+# Single image as a (1, H, W, 3) uint8 batch, same layout the model was trained on
+def preprocess_image(source, size=IMAGE_SIZE):
+    out = np.empty((1, size[1], size[0], 3), dtype=np.uint8)
+    preprocess_into(source, out[0], size)
+    return out
+
+
+# Decode several images straight into the rows of out, in parallel on executor
+# (PIL releases the GIL while decoding and resizing). Returns one entry per
+# source: None when its row was filled, otherwise the error it failed with.
+def preprocess_many(sources, out, executor, size=IMAGE_SIZE, use_draft=USE_JPEG_DRAFT):
+    def fill_row(i):
+        try:
+            preprocess_into(sources[i], out[i], size, use_draft)
+        except IMAGE_ERRORS as e:
+            return e
+        return None
+
+    return list(executor.map(fill_row, range(len(sources))))
+
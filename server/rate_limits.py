@@ -0,0 +1,93 @@
+import os
+
+import jwt
+from dotenv import load_dotenv
+from flask import current_app, g, request
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter
+
+from database import client_options
+
+load_dotenv()
+
+# Where the limiter keeps its counters. The default memory:// is per process,
+# so with several workers or hosts every one of them hands out the full
+# budget. Shared backends (counters are incremented atomically in one round trip):
+#   mongodb://... or mongodb+srv://...  fixed-window counters in the app's
+#       database, expired by a TTL index (the limits package does the update)
+#   redis://host:6379 (or any Redis-compatible server)  needs the redis package
+RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+
+
+def storage_options(uri):
+    if uri.startswith(("mongodb://", "mongodb+srv://")):
+        # Same pool and timeouts as the app's own client
+        return {
+            "database_name": "ImageClassification",
+            "counter_collection_name": "rate_limits",
+            "window_collection_name": "rate_limit_windows",
+            **client_options(),
+        }
+    return {}
+
+
+# user_id from a valid login cookie, decoded once per request
+def token_user_id():
+    if "token_user_id" not in g:
+        user_id = None
+        token = request.cookies.get("token")
+        if token:
+            try:
+                user_id = jwt.decode(token, current_app.secret_key, algorithms=["HS256"]).get("user_id")
+            except jwt.InvalidTokenError:
+                pass
+        g.token_user_id = user_id
+    return g.token_user_id
+
+
+# Signed-in requests are counted per user, so users behind one NAT don't share
+# a budget and one user can't reset theirs by switching networks. Everything
+# else is counted per client IP.
+def user_or_ip():
+    user_id = token_user_id()
+    return f"user:{user_id}" if user_id else get_remote_address()
+
+
+def create_limiter(app=None, storage_uri=RATELIMIT_STORAGE_URI):
+    return Limiter(
+        user_or_ip,
+        app=app,
+        storage_uri=storage_uri,
+        storage_options=storage_options(storage_uri),
+        # Keep limiting (per process) while the shared storage is unreachable
+        in_memory_fallback_enabled=not storage_uri.startswith("memory://"),
+    )
+
+
+_fallback_limiter = FixedWindowRateLimiter(MemoryStorage())
+
+
+# For budgets a route takes itself once it knows what the request costs: one
+# atomic hit of `cost` against `limit` for this request's user or IP, False
+# when it doesn't fit. Like the limiter, counts per process while the shared
+# storage is unreachable.
+def hit(limiter, limit, scope, cost=1):
+    if not limiter.enabled:
+        return True
+    key = user_or_ip()
+    try:
+        return _hit(limiter.limiter, limit, key, scope, cost)
+    except Exception as e:
+        print(f"Rate limit storage unreachable, counting in memory: {e}")
+        return _hit(_fallback_limiter, limit, key, scope, cost)
+
+
+# The counter is incremented before it is compared, a hit that doesn't fit
+# gives its cost back so a request turned away costs nothing
+def _hit(rate_limiter, limit, key, scope, cost):
+    if rate_limiter.hit(limit, key, scope, cost=cost):
+        return True
+    rate_limiter.storage.incr(limit.key_for(key, scope), limit.get_expiry(), amount=-cost)
+    return False
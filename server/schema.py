@@ -3,17 +3,19 @@ from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Random import get_random_bytes
 from Crypto.Hash import SHA256
 import base64
-import bcrypt
 import hashlib
 import json
 import uuid
 from datetime import datetime
+from hashing import bcrypt_service
+from encryption import EnvelopeError, Sealer
 
 # Load MASTER_KEY from .env
 import os
 from dotenv import load_dotenv
 load_dotenv()
 MASTER_KEY = base64.b64decode(os.getenv("AES_MASTER_KEY"))
+sealer = Sealer(MASTER_KEY)
 
 # AES-GCM Encryption
 def aes_encrypt(data, key):
@@ -43,26 +45,81 @@ def hash_username(username):
 
 # User Schema
 class UserSchema:
-    def __init__(self, username, password):
+    def __init__(self, username, password, hashed_password=None):
         self.user_id = str(uuid.uuid4())
         self.username_hash = hash_username(username)
         self.encrypted_username = aes_encrypt(username, MASTER_KEY)
-        self.password = self.hash_password(password)
+        # Async callers hash on the pool themselves and pass the result in
+        self.password = hashed_password or self.hash_password(password)
         self.created_at = datetime.utcnow()
-        self.predictions = []
+        # Predictions live in their own collection, the user only keeps a summary
+        self.prediction_count = 0
+        self.last_prediction_at = None
 
     def hash_password(self, password):
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
+        # bcrypt runs in the hashing process pool, not on the request thread
+        return bcrypt_service.hash(password)
 
     def to_dict(self):
-        return {
+        user = {
             "user_id": self.user_id,
             "username_hash": self.username_hash,
             "name": self.encrypted_username,
             "password": self.password,
             "created_at": self.created_at,
-            "predictions": self.predictions  # still encrypted
+            "prediction_count": self.prediction_count
         }
+        # Left out until the first prediction sets it with $max, not every
+        # store (mongomock) can compare a stored null against a date
+        if self.last_prediction_at is not None:
+            user["last_prediction_at"] = self.last_prediction_at
+        return user
+
+# Prediction Schema (one document per prediction in the predictions collection).
+# The small fields are sealed together in one envelope and the raw image bytes
+# in another, both bound to the user id. Older documents have every field
+# aes_encrypt-ed on its own (the image base64 encoded first); the readers
+# below handle both.
+class PredictionSchema:
+    def __init__(self, user_id, image_bytes, result, image_url, predicted_at=None):
+        self.user_id = user_id
+        self.created_at = predicted_at or datetime.utcnow()  # plain, used for indexing and paging
+        self.record = sealer.seal_record({"result": result, "image_url": image_url}, _record_context(user_id))
+        self.image = sealer.seal(image_bytes, _image_context(user_id))
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "created_at": self.created_at,
+            "record": self.record,
+            "image": self.image
+        }
+
+def _record_context(user_id):
+    return b"prediction:" + user_id.encode('utf-8')
+
+def _image_context(user_id):
+    return b"prediction-image:" + user_id.encode('utf-8')
+
+# Decrypted result / image_url of a stored prediction (only the requested ones
+# for old documents, a sealed record is opened as a whole). None if it can't be read.
+def read_prediction(doc, user_id, fields=("result", "image_url")):
+    if "record" in doc:
+        try:
+            record = sealer.open_record(doc["record"], _record_context(user_id))
+        except EnvelopeError as e:
+            print("Decryption failed:", e)
+            return None
+        return {field: record.get(field) for field in fields}
+    return {field: aes_decrypt(doc[field], MASTER_KEY) if doc.get(field) else None for field in fields}
 
+# Raw bytes of the uploaded image, None if it can't be read
+def read_prediction_image(doc, user_id):
+    if "image" in doc:
+        try:
+            return sealer.open(doc["image"], _image_context(user_id))
+        except EnvelopeError as e:
+            print("Decryption failed:", e)
+            return None
+    image_base64 = aes_decrypt(doc["input_image"], MASTER_KEY) if doc.get("input_image") else None
+    return base64.b64decode(image_base64) if image_base64 is not None else None
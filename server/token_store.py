@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+# Tokens are kept by their SHA-256, so the store never holds a usable link
+# (and a digest is smaller than the serializer's token string)
+def token_key(token):
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+# One-time login tokens in this process: token -> email until it is consumed,
+# expires or is pushed out by newer tokens. Every token gets the same TTL and
+# is only ever read by consuming it, so issue order is both expiry order and
+# least-recently-used order, and eviction is popping from the front.
+class MemoryTokenStore:
+    def __init__(self, ttl_seconds=900, max_entries=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (email, monotonic expiry time)
+        self._lock = threading.Lock()
+        self._counters = {"issued": 0, "consumed": 0, "rejected": 0, "expired": 0, "evicted": 0}
+
+    def issue(self, token, email):
+        now = time.monotonic()
+        with self._lock:
+            # The serializer's timestamp has 1s resolution, so the same email can
+            # get the same token twice: it moves to the back with its new expiry
+            key = token_key(token)
+            self._entries[key] = (email, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._counters["issued"] += 1
+            self._evict(now)
+
+    # The email the token was issued for, or None if it is unknown, expired or
+    # already used. Removed under the lock, so only one caller ever gets it.
+    def consume(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(token_key(token), None)
+            if entry is None or entry[1] <= now:
+                self._counters["rejected"] += 1
+                return None
+            self._counters["consumed"] += 1
+            return entry[0]
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            key, (_, expires_at) = next(iter(entries.items()))
+            if expires_at <= now:
+                self._counters["expired"] += 1
+            elif len(entries) > self.max_entries:
+                self._counters["evicted"] += 1
+            else:
+                return
+            entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return dict(self._counters, backend="memory", entries=len(self._entries), max_entries=self.max_entries)
+
+
+# Shared between workers and hosts: one document per token in a Mongo
+# collection, removed by the TTL index on expire_at (database.ensure_indexes).
+# Consuming is a single find_one_and_delete, so of two workers racing for the
+# same token only one gets the email back.
+class MongoTokenStore:
+    def __init__(self, collection, ttl_seconds=900):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    # An upsert, the same token can be issued twice within a second
+    def issue(self, token, email):
+        self.collection.update_one(
+            {"_id": token_key(token)},
+            {"$set": {"email": email, "expire_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)}},
+            upsert=True
+        )
+
+    # The TTL monitor only runs once a minute, so expiry is checked here too
+    def consume(self, token):
+        doc = self.collection.find_one_and_delete(
+            {"_id": token_key(token), "expire_at": {"$gt": datetime.utcnow()}}, {"_id": 0, "email": 1}
+        )
+        return doc["email"] if doc else None
+
+    def stats(self):
+        return {"backend": "mongo", "entries": self.collection.estimated_document_count()}
+
+
+# MAGIC_LINK_STORE=mongo (default) shares tokens between workers and hosts.
+# MAGIC_LINK_STORE=memory keeps them in this process, where a link only works
+# on the worker that issued it, so it is refused with more than one worker
+# (WEB_CONCURRENCY, which gunicorn.conf.py sets for its workers).
+def create_token_store(collection, ttl_seconds):
+    if os.getenv("MAGIC_LINK_STORE", "mongo") != "memory":
+        return MongoTokenStore(collection, ttl_seconds)
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        raise ValueError(f"MAGIC_LINK_STORE=memory needs a single worker, WEB_CONCURRENCY is {workers}")
+    return MemoryTokenStore(ttl_seconds, max_entries=int(os.getenv("MAGIC_LINK_MAX_TOKENS", 100000)))
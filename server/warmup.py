@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+# Startup work that used to block the import of app.py (Mongo ping, model
+# load). Each check runs in its own background thread and is retried with
+# backoff until it passes once; /readyz reports ready when all of them have.
+class Warmup:
+    def __init__(self, retry_delay=1, max_retry_delay=30):
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._checks = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def add(self, name, check):
+        self._checks[name] = check
+        self._state[name] = {"ready": False, "attempts": 0, "seconds": None, "error": None}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for name, check in self._checks.items():
+            threading.Thread(target=self._run, args=(name, check), name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self, name, check):
+        start = time.monotonic()
+        delay = self.retry_delay
+        while True:
+            try:
+                check()
+            except Exception as e:
+                with self._lock:
+                    state = self._state[name]
+                    state["attempts"] += 1
+                    state["error"] = f"{type(e).__name__}: {e}"
+                print(f"Warmup {name} failed (retrying in {delay}s): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            with self._lock:
+                state = self._state[name]
+                state.update(ready=True, attempts=state["attempts"] + 1,
+                             seconds=round(time.monotonic() - start, 3), error=None)
+            print(f"Warmup {name} done in {time.monotonic() - start:.2f}s")
+            return
+
+    def ready(self):
+        with self._lock:
+            return all(state["ready"] for state in self._state.values())
+
+    def status(self):
+        with self._lock:
+            return {name: dict(state) for name, state in self._state.items()}